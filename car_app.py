@@ -0,0 +1,286 @@
+from concurrent.futures import ThreadPoolExecutor
+from qgis.core import (QgsTask, QgsGeometry, QgsFeature, QgsFeatureRequest, QgsWkbTypes,
+                       QgsCoordinateReferenceSystem, QgsCoordinateTransform,
+                       QgsVectorLayerFeatureSource)
+from PyQt5.QtCore import QDate, QThread
+from .car_session import scoped_car_layers
+from .car_export import TARGET_CRS
+from .car_validation import IMOVEL_LAYER
+
+# Faixas de APP de cursos d'água (Lei 12.651/2012, art. 4º): largura máxima do
+# curso d'água (m), largura da APP (m) e camada do CAR que recebe o polígono
+APP_CLASSES = [
+    (10, 30, 'Curso d\'água natural com até 10metros (MultiPolygon)'),
+    (50, 50, 'Curso d\'água natural de 10 a 50 metros'),
+    (200, 100, 'Curso d\'água natural de 50 a 200 metros'),
+    (600, 200, 'Curso d\'água natural de 200 a 600 metros'),
+    (None, 500, 'Curso d\'água natural acima de 600 metros'),
+]
+
+# Raio da APP de nascentes (m); a camada do CAR guarda o ponto da nascente
+SPRING_RADIUS = 50
+SPRING_LAYER = 'Nascente ou olho d\'agua perene'
+
+# Feições geradas são marcadas na descrição para que uma nova geração as substitua
+GENERATED_DESCRIPTION = 'APP gerada automaticamente'
+
+# Feições por bloco processado em cada thread
+CHUNK_SIZE = 500
+
+
+def app_class_index(width):
+    if width is None:
+        return 0
+    for index, (max_width, app_width, layer_name) in enumerate(APP_CLASSES):
+        if max_width is None or width <= max_width:
+            return index
+    return len(APP_CLASSES) - 1
+
+
+def metric_crs_for(point):
+    # Fuso UTM SIRGAS 2000 do ponto (EPSG:31971-31976 norte, 31978-31985 sul);
+    # fora dos fusos do Brasil, a Policônica SIRGAS 2000
+    zone = int((point.x() + 180) / 6) + 1
+    if point.y() < 0 and 18 <= zone <= 25:
+        return QgsCoordinateReferenceSystem(f'EPSG:{31960 + zone}')
+    if point.y() >= 0 and 17 <= zone <= 22:
+        return QgsCoordinateReferenceSystem(f'EPSG:{31954 + zone}')
+    return QgsCoordinateReferenceSystem('EPSG:5880')
+
+
+def map_in_threads(task, function, items, progress_share=100):
+    # Aplica function a cada item num conjunto de threads e devolve os resultados na
+    # ordem dos itens, ou None se a tarefa for cancelada. Ao cancelar, os itens que
+    # ainda não começaram são descartados em vez de processados até o fim.
+    executor = ThreadPoolExecutor(max_workers=max(1, QThread.idealThreadCount()))
+    try:
+        futures = [executor.submit(function, item) for item in items]
+        results = []
+        for done, future in enumerate(futures, 1):
+            if task.isCanceled():
+                return None
+            results.append(future.result())
+            task.setProgress(done * progress_share / len(futures))
+        return None if task.isCanceled() else results
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def buffer_chunk(items, imovel_wkb, is_canceled=None):
+    # Roda numa thread de trabalho: bufferiza um bloco de feições e recorta pelo
+    # Imóvel. Cada bloco usa sua própria geometria preparada.
+    imovel = QgsGeometry()
+    imovel.fromWkb(imovel_wkb)
+    engine = QgsGeometry.createGeometryEngine(imovel.constGet())
+    engine.prepareGeometry()
+
+    buffers = {}
+    for class_index, geometry, distance, is_polygon in items:
+        if is_canceled and is_canceled():
+            return {}
+        app = geometry.buffer(distance, 8)
+        if is_polygon:
+            # APP é a faixa a partir da margem: tira o próprio leito
+            app = app.difference(geometry)
+        if app.isEmpty() or not engine.intersects(app.constGet()):
+            continue
+        buffers.setdefault(class_index, []).append(app)
+
+    clipped = {}
+    for class_index, geometries in buffers.items():
+        merged = QgsGeometry.unaryUnion(geometries).intersection(imovel)
+        if not merged.isEmpty():
+            clipped[class_index] = merged
+    return clipped
+
+
+class AppGenerationTask(QgsTask):
+    def __init__(self, imovel_layer, rivers_layer, width_field, springs_layer, project):
+        super().__init__("GeoCAR Poupa Tempo: geração de APP", QgsTask.CanCancel)
+        context = project.transformContext()
+        self.context = context
+        # Retratos das camadas para leitura em segundo plano
+        self.imovel = (QgsVectorLayerFeatureSource(imovel_layer), imovel_layer.crs())
+        self.rivers = (QgsVectorLayerFeatureSource(rivers_layer), rivers_layer.crs()) if rivers_layer else None
+        self.rivers_are_polygons = (rivers_layer is not None and
+                                    rivers_layer.geometryType() == QgsWkbTypes.PolygonGeometry)
+        self.width_index = rivers_layer.fields().indexOf(width_field) if rivers_layer and width_field else -1
+        self.springs = (QgsVectorLayerFeatureSource(springs_layer), springs_layer.crs()) if springs_layer else None
+        self.results = {}
+        self.springs_inside = []
+        self.without_width = 0
+        self.error = None
+
+    def read_geometries(self, source, crs, target_crs, attributes=None):
+        request = QgsFeatureRequest()
+        if attributes:
+            request.setSubsetOfAttributes(attributes)
+        else:
+            request.setNoAttributes()
+        if crs != target_crs:
+            request.setDestinationCrs(target_crs, self.context)
+        return source.getFeatures(request)
+
+    def run(self):
+        try:
+            return self.generate()
+        except Exception as e:
+            self.error = str(e)
+            return False
+
+    def generate(self):
+        target_crs = QgsCoordinateReferenceSystem(TARGET_CRS)
+        source, crs = self.imovel
+        parts = [f.geometry() for f in self.read_geometries(source, crs, target_crs) if f.hasGeometry()]
+        if not parts:
+            raise RuntimeError('A camada Imóvel está vazia')
+        imovel = QgsGeometry.unaryUnion(parts)
+
+        # Buffers em metros num CRS projetado adequado ao imóvel
+        metric_crs = metric_crs_for(imovel.centroid().asPoint())
+        to_metric = QgsCoordinateTransform(target_crs, metric_crs, self.context)
+        to_target = QgsCoordinateTransform(metric_crs, target_crs, self.context)
+        imovel_metric = QgsGeometry(imovel)
+        imovel_metric.transform(to_metric)
+
+        if self.rivers is not None:
+            self.generate_rivers(metric_crs, imovel_metric, to_target)
+        if self.springs is not None:
+            self.select_springs(metric_crs, imovel_metric, to_target)
+        return not self.isCanceled()
+
+    def generate_rivers(self, metric_crs, imovel_metric, to_target):
+        source, crs = self.rivers
+        attributes = [self.width_index] if self.width_index >= 0 else []
+        chunks, chunk = [], []
+        for feature in self.read_geometries(source, crs, metric_crs, attributes):
+            if not feature.hasGeometry():
+                continue
+            width = feature.attribute(self.width_index) if self.width_index >= 0 else None
+            try:
+                width = float(width) if width is not None else None
+            except (TypeError, ValueError):
+                width = None
+            if width is None:
+                self.without_width += 1
+            class_index = app_class_index(width)
+            distance = APP_CLASSES[class_index][1]
+            if not self.rivers_are_polygons and width:
+                # Linha de centro: a APP começa na margem, a meia largura do eixo
+                distance += width / 2
+            chunk.append((class_index, feature.geometry(), distance, self.rivers_are_polygons))
+            if len(chunk) >= CHUNK_SIZE:
+                chunks.append(chunk)
+                chunk = []
+        if chunk:
+            chunks.append(chunk)
+
+        imovel_wkb = imovel_metric.asWkb()
+        per_class = {}
+        chunk_results = map_in_threads(self, lambda c: buffer_chunk(c, imovel_wkb, self.isCanceled),
+                                       chunks, progress_share=90)
+        if chunk_results is None:
+            return
+        for clipped in chunk_results:
+            for class_index, geometry in clipped.items():
+                per_class.setdefault(class_index, []).append(geometry)
+
+        for class_index, geometries in per_class.items():
+            geometry = QgsGeometry.unaryUnion(geometries)
+            geometry.transform(to_target)
+            self.results[APP_CLASSES[class_index][2]] = geometry
+
+    def select_springs(self, metric_crs, imovel_metric, to_target):
+        # Nascentes cujo raio de APP alcança o imóvel
+        source, crs = self.springs
+        engine = QgsGeometry.createGeometryEngine(imovel_metric.constGet())
+        engine.prepareGeometry()
+        for feature in self.read_geometries(source, crs, metric_crs):
+            if not feature.hasGeometry():
+                continue
+            if engine.intersects(feature.geometry().buffer(SPRING_RADIUS, 8).constGet()):
+                point = QgsGeometry(feature.geometry())
+                point.transform(to_target)
+                self.springs_inside.append(point)
+
+
+def find_car_layer(project, layer_name):
+    # Só camadas registradas pelo plugin, nunca uma camada de apoio de mesmo nome;
+    # com imóveis na sessão, só as do imóvel ativo
+    layers = [layer for layer in scoped_car_layers(project) if layer.name() == layer_name]
+    if len(layers) > 1:
+        raise RuntimeError(f"Mais de uma camada do CAR com o nome {layer_name}; "
+                           f"organize os imóveis em uma sessão ou remova a camada repetida")
+    return layers[0] if layers else None
+
+
+def write_generated_features(layer, geometries, description=GENERATED_DESCRIPTION):
+    # Substitui as feições geradas anteriormente (mesma descrição), mantendo as digitalizadas à mão.
+    # A gravação vai direto ao provedor: camadas em edição ficam de fora (skip_editing).
+    provider = layer.dataProvider()
+    description_index = layer.fields().indexOf('descricao')
+    date_index = layer.fields().indexOf('data_criacao')
+    if description_index >= 0:
+        old_ids = [f.id() for f in layer.getFeatures(
+            QgsFeatureRequest().setFilterExpression(f"\"descricao\" = '{description}'"))]
+        provider.deleteFeatures(old_ids)
+
+    multi = QgsWkbTypes.isMultiType(layer.wkbType())
+    features = []
+    for geometry in geometries:
+        for part in geometry.asGeometryCollection():
+            if multi:
+                part.convertToMultiType()
+            feature = QgsFeature(layer.fields())
+            feature.setGeometry(part)
+            if description_index >= 0:
+                feature.setAttribute(description_index, description)
+            if date_index >= 0:
+                feature.setAttribute(date_index, QDate.currentDate())
+            features.append(feature)
+    provider.addFeatures(features)
+    layer.updateExtents()
+    layer.triggerRepaint()
+    return len(features)
+
+
+def skip_editing(layer, log=None):
+    # A gravação direta no provedor passaria por cima do buffer de edição e deixaria
+    # as edições pendentes apontando para feições apagadas
+    if not layer.isEditable():
+        return False
+    if log:
+        log(f"Camada em edição, não alterada: {layer.name()}")
+    return True
+
+
+def apply_app_results(project, task, log=None):
+    # Roda na thread principal, depois da tarefa: grava nas camadas do CAR
+    for layer_name, geometry in task.results.items():
+        layer = find_car_layer(project, layer_name)
+        if layer is None:
+            if log:
+                log(f"Camada não encontrada no projeto: {layer_name}")
+            continue
+        if skip_editing(layer, log):
+            continue
+        count = write_generated_features(layer, [geometry])
+        if log:
+            log(f"APP gerada em {layer_name}: {count} polígono(s)")
+
+    if task.springs is not None:
+        layer = find_car_layer(project, SPRING_LAYER)
+        if layer is None:
+            if log:
+                log(f"Camada não encontrada no projeto: {SPRING_LAYER}")
+        elif not skip_editing(layer, log):
+            count = write_generated_features(layer, task.springs_inside)
+            if log:
+                log(f"Nascentes com APP no imóvel: {count}")
+
+    if task.without_width and log:
+        log(f"{task.without_width} curso(s) d'água sem largura foram tratados como até 10 metros")
+
+
+def imovel_layer(project):
+    return find_car_layer(project, IMOVEL_LAYER)
@@ -0,0 +1,156 @@
+import os
+import csv
+from qgis.core import QgsDistanceArea, QgsWkbTypes
+from PyQt5.QtCore import QObject, pyqtSignal
+from .car_core import build_layer_structure, iter_structure_layers, is_car_layer
+
+AREA_TABLE_NAME = "quadro_de_areas.csv"
+
+IMOVEL_ROW = 'Área do imóvel'
+RESERVA_ROW = 'Reserva Legal'
+
+# Linhas do quadro de áreas e as camadas do CAR somadas em cada uma
+AREA_ROWS = [
+    (IMOVEL_ROW, ['Imóvel']),
+    ('Remanescente de Vegetação Nativa', ['Remanescente de Vegetação Nativa']),
+    ('Área Consolidada', ['Área Consolidada']),
+    ('Área de Preservação Permanente',
+     [name for path, name, geom_type in iter_structure_layers(build_layer_structure(['app']))
+      if 'Área de Preservação Permanente' in path and geom_type == 'MultiPolygon']),
+    (RESERVA_ROW, ['Reserva Legal Proposta', 'Reserva Legal Averbada',
+                   'Reserva Legal Aprovada e não Averbada']),
+]
+
+TRACKED_NAMES = {name for label, names in AREA_ROWS for name in names}
+
+
+class AreaLedger(QObject):
+    # Áreas elipsoidais (GRS80, elipsoide do SIRGAS 2000) de cada feição das camadas
+    # do quadro de áreas. Depois do cálculo inicial, só as feições alteradas são
+    # recalculadas, a partir dos sinais de edição das camadas.
+    changed = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.layers = {}
+        self.areas = {}
+        self.totals = {}
+        self.measures = {}
+
+    def track(self, layer):
+        if (not is_car_layer(layer) or layer.id() in self.layers
+                or layer.name() not in TRACKED_NAMES
+                or layer.geometryType() != QgsWkbTypes.PolygonGeometry):
+            return
+        layer_id = layer.id()
+        self.layers[layer_id] = layer
+        measure = QgsDistanceArea()
+        measure.setSourceCrs(layer.crs(), layer.transformContext())
+        measure.setEllipsoid('GRS80')
+        self.measures[layer_id] = measure
+        self.recompute_layer(layer_id)
+
+        layer.featureAdded.connect(lambda fid, layer_id=layer_id: self.feature_added(layer_id, fid))
+        layer.featureDeleted.connect(lambda fid, layer_id=layer_id: self.feature_deleted(layer_id, fid))
+        layer.geometryChanged.connect(
+            lambda fid, geometry, layer_id=layer_id: self.geometry_changed(layer_id, fid, geometry))
+        layer.committedFeaturesAdded.connect(
+            lambda lid, features, layer_id=layer_id: self.features_committed(layer_id, features))
+        layer.afterRollBack.connect(lambda layer_id=layer_id: self.recompute_layer(layer_id))
+        self.changed.emit()
+
+    def track_all(self, layers):
+        for layer in layers:
+            self.track(layer)
+
+    def untrack(self, layer_ids):
+        removed = False
+        for layer_id in layer_ids:
+            if self.layers.pop(layer_id, None) is not None:
+                self.areas.pop(layer_id, None)
+                self.totals.pop(layer_id, None)
+                self.measures.pop(layer_id, None)
+                removed = True
+        if removed:
+            self.changed.emit()
+
+    def clear(self):
+        self.untrack(list(self.layers))
+
+    def area(self, layer_id, geometry):
+        if geometry is None or geometry.isEmpty():
+            return 0.0
+        return self.measures[layer_id].measureArea(geometry)
+
+    def set_area(self, layer_id, fid, area):
+        areas = self.areas[layer_id]
+        self.totals[layer_id] += area - areas.get(fid, 0.0)
+        areas[fid] = area
+
+    def recompute_layer(self, layer_id):
+        # Cálculo completo: ao acompanhar a camada, depois de desfazer edições ou
+        # após gravações em lote feitas direto no provedor
+        layer = self.layers.get(layer_id)
+        if layer is None:
+            return
+        self.areas[layer_id] = {f.id(): self.area(layer_id, f.geometry()) for f in layer.getFeatures()}
+        self.totals[layer_id] = sum(self.areas[layer_id].values())
+        self.changed.emit()
+
+    def refresh(self):
+        for layer_id in list(self.layers):
+            self.recompute_layer(layer_id)
+
+    def feature_added(self, layer_id, fid):
+        layer = self.layers.get(layer_id)
+        if layer is None:
+            return
+        self.set_area(layer_id, fid, self.area(layer_id, layer.getFeature(fid).geometry()))
+        self.changed.emit()
+
+    def feature_deleted(self, layer_id, fid):
+        if layer_id not in self.layers:
+            return
+        self.totals[layer_id] -= self.areas[layer_id].pop(fid, 0.0)
+        self.changed.emit()
+
+    def geometry_changed(self, layer_id, fid, geometry):
+        if layer_id not in self.layers:
+            return
+        self.set_area(layer_id, fid, self.area(layer_id, geometry))
+        self.changed.emit()
+
+    def features_committed(self, layer_id, features):
+        # Ao salvar, as feições novas trocam o id temporário (negativo) pelo definitivo
+        if layer_id not in self.layers:
+            return
+        areas = self.areas[layer_id]
+        for fid in [fid for fid in areas if fid < 0]:
+            self.totals[layer_id] -= areas.pop(fid)
+        for feature in features:
+            self.set_area(layer_id, feature.id(), self.area(layer_id, feature.geometry()))
+        self.changed.emit()
+
+    def name_total(self, name):
+        return sum(self.totals[layer_id] for layer_id, layer in self.layers.items()
+                   if layer.name() == name)
+
+    def rows(self):
+        # [(classe, área em hectares)] e, por último, o percentual de Reserva Legal
+        rows = [(label, sum(self.name_total(name) for name in names) / 10000.0)
+                for label, names in AREA_ROWS]
+        values = dict(rows)
+        imovel = values[IMOVEL_ROW]
+        reserva_percent = values[RESERVA_ROW] / imovel * 100 if imovel else 0.0
+        return rows, reserva_percent
+
+
+def write_area_table(folder, rows, reserva_percent):
+    path = os.path.join(folder, AREA_TABLE_NAME)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(['classe', 'area_ha'])
+        for label, hectares in rows:
+            writer.writerow([label, f"{hectares:.4f}"])
+        writer.writerow(['Reserva Legal (% do imóvel)', f"{reserva_percent:.2f}"])
+    return path
@@ -0,0 +1,166 @@
+import os
+import csv
+import json
+import time
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from qgis.core import QgsApplication
+from .car_core import (SOURCE_EXTENSIONS, PACKAGE_EXTENSIONS, parse_groups,
+                       build_layer_structure, build_car_layers, load_source_data,
+                       export_car_layers)
+from .car_export import car_folder_path, export_writer
+from .car_areas import AreaLedger, write_area_table
+
+REPORT_COLUMNS = ['cliente', 'status', 'pasta', 'exportadas', 'mantidas', 'erros',
+                  'tempo_criacao', 'tempo_carga', 'tempo_exportacao', 'tempo_total', 'mensagem']
+
+
+def read_batch_input(path):
+    # Pasta: cada arquivo vetorial, ZIP ou subpasta é um imóvel, com o nome do cliente
+    # tirado do nome do arquivo. CSV: colunas cliente, fonte, grupos e formato (opcionais as três últimas).
+    if os.path.isdir(path):
+        items = []
+        for entry in sorted(os.listdir(path)):
+            full_path = os.path.join(path, entry)
+            if os.path.isdir(full_path) or entry.lower().endswith(SOURCE_EXTENSIONS + PACKAGE_EXTENSIONS):
+                items.append({'cliente': os.path.splitext(entry)[0], 'fonte': full_path, 'grupos': ''})
+        return items
+
+    base_folder = os.path.dirname(os.path.abspath(path))
+    items = []
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        for row in csv.DictReader(f, dialect=dialect):
+            row = {key.strip().lower(): (value or '').strip() for key, value in row.items() if key}
+            if not row.get('cliente'):
+                continue
+            source = row.get('fonte', '')
+            if source and not os.path.isabs(source):
+                source = os.path.join(base_folder, source)
+            items.append({'cliente': row['cliente'], 'fonte': source, 'grupos': row.get('grupos', ''),
+                          'formato': row.get('formato', '')})
+    return items
+
+
+def process_property(item, output_folder, default_groups=None, log=None, feedback=None):
+    # Cria a estrutura do CAR de um imóvel em camadas avulsas, carrega a fonte e exporta
+    result = {'cliente': item['cliente'], 'status': 'ok', 'pasta': '', 'exportadas': 0,
+              'mantidas': 0, 'erros': 0, 'tempo_criacao': 0.0, 'tempo_carga': 0.0,
+              'tempo_exportacao': 0.0, 'tempo_total': 0.0, 'mensagem': ''}
+    started = time.perf_counter()
+    try:
+        groups = parse_groups(item.get('grupos') or default_groups)
+
+        step = time.perf_counter()
+        layers = build_car_layers(build_layer_structure(groups))
+        result['tempo_criacao'] = round(time.perf_counter() - step, 3)
+
+        step = time.perf_counter()
+        if item.get('fonte'):
+            if not os.path.exists(item['fonte']):
+                raise FileNotFoundError(f"Fonte não encontrada: {item['fonte']}")
+            load_source_data(layers, item['fonte'], log)
+        result['tempo_carga'] = round(time.perf_counter() - step, 3)
+
+        step = time.perf_counter()
+        car_folder = car_folder_path(item['cliente'], output_folder)
+        result['pasta'] = car_folder
+        exported, skipped, failed = export_car_layers(layers, car_folder, log=log, feedback=feedback,
+                                                      writer=export_writer(item.get('formato')))
+        ledger = AreaLedger()
+        ledger.track_all(layers)
+        write_area_table(car_folder, *ledger.rows())
+        result['tempo_exportacao'] = round(time.perf_counter() - step, 3)
+
+        result['exportadas'] = len(exported)
+        result['mantidas'] = len(skipped)
+        result['erros'] = len(failed)
+        if failed:
+            result['status'] = 'parcial'
+            result['mensagem'] = f"Camadas com erro: {', '.join(failed)}"
+    except Exception as e:
+        result['status'] = 'erro'
+        result['mensagem'] = str(e)
+    result['tempo_total'] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def find_qgis_process():
+    for name in ('qgis_process', 'qgis_process-qgis.bat', 'qgis_process-qgis-ltr.bat'):
+        path = shutil.which(name)
+        if path:
+            return path
+    bin_folder = os.path.join(QgsApplication.prefixPath(), 'bin')
+    for name in ('qgis_process', 'qgis_process.exe', 'qgis_process-qgis.bat'):
+        path = os.path.join(bin_folder, name)
+        if os.path.exists(path):
+            return path
+    raise RuntimeError("Executável qgis_process não encontrado")
+
+
+def process_property_subprocess(qgis_process, item, output_folder, default_groups):
+    # Cada imóvel roda num qgis_process separado, com o algoritmo geocar:exportarimovel
+    started = time.perf_counter()
+    groups = item.get('grupos') or ','.join(parse_groups(default_groups))
+    command = [qgis_process, '--json', 'run', 'geocar:exportarimovel',
+               f"--CLIENT_NAME={item['cliente']}",
+               f"--SOURCE={item.get('fonte') or ''}",
+               f"--GROUP_KEYS={groups}",
+               f"--OUTPUT_FOLDER={output_folder}",
+               f"--FORMAT={item.get('formato') or ''}"]
+    completed = subprocess.run(command, capture_output=True, text=True, encoding='utf-8')
+    try:
+        output = json.loads(completed.stdout)
+        result = json.loads(output['results']['RESULT_JSON'])
+    except (ValueError, KeyError, TypeError):
+        message = (completed.stderr or completed.stdout).strip().splitlines()
+        result = {'cliente': item['cliente'], 'status': 'erro',
+                  'mensagem': message[-1] if message else f"qgis_process retornou {completed.returncode}"}
+    # Inclui a inicialização do qgis_process no tempo total
+    result['tempo_total'] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def run_batch(items, output_folder, default_groups=None, workers=1, log=None, feedback=None):
+    results = []
+    if workers <= 1:
+        for index, item in enumerate(items):
+            if feedback is not None and feedback.isCanceled():
+                break
+            if log:
+                log(f"Processando imóvel: {item['cliente']}")
+            results.append(process_property(item, output_folder, default_groups, log))
+            if feedback is not None:
+                feedback.setProgress((index + 1) * 100 / len(items))
+        return results
+
+    qgis_process = find_qgis_process()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_property_subprocess, qgis_process, item,
+                                   output_folder, default_groups): item for item in items}
+        for done, future in enumerate(as_completed(futures), 1):
+            if feedback is not None and feedback.isCanceled():
+                for pending in futures:
+                    pending.cancel()
+                break
+            result = future.result()
+            results.append(result)
+            if log:
+                log(f"Imóvel {result['cliente']}: {result['status']} em {result['tempo_total']} s")
+            if feedback is not None:
+                feedback.setProgress(done * 100 / len(items))
+    return results
+
+
+def write_report(path, results):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS, extrasaction='ignore', delimiter=';')
+        writer.writeheader()
+        for result in results:
+            writer.writerow({column: result.get(column, '') for column in REPORT_COLUMNS})
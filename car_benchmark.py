@@ -0,0 +1,293 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from osgeo import gdal
+from qgis.core import (Qgis, QgsApplication, QgsProject, QgsFeature, QgsGeometry, QgsPointXY)
+from .car_core import CAR_GROUPS, build_layer_structure, create_car_structure, export_car_layers
+from .car_export import LayerExportJob, EXPORT_WRITERS, write_shapefile, zip_shapefile
+from .car_template import create_car_structure_from_template, template_path
+
+try:
+    import resource
+except ImportError:
+    # Windows: sem ru_maxrss, só o pico de memória do Python
+    resource = None
+
+# Benchmark sem interface e sem rede da criação e da exportação das camadas do CAR
+# em imóveis sintéticos. Uso, a partir da pasta de plugins do QGIS:
+#   python -m CAR_Pa_Poupa_Tempo.car_benchmark --output resultado.json
+#   python -m CAR_Pa_Poupa_Tempo.car_benchmark --compare base.json
+
+# Número de feições e vértices por feição de cada cenário
+DEFAULT_FEATURES = [300, 5000, 50000, 200000]
+DEFAULT_VERTICES = [16, 128]
+
+# Camadas que recebem as feições sintéticas, em rodízio
+FILL_LAYERS = ['Remanescente de Vegetação Nativa', 'Área Consolidada', 'Reserva Legal Proposta']
+
+# Canto do imóvel sintético (SIRGAS 2000, sudeste do Pará) e lado de cada célula em graus
+ORIGIN = (-49.5, -6.0)
+CELL_SIZE = 0.001
+
+# Feições por chamada a addFeatures
+ADD_CHUNK_SIZE = 10000
+
+# Variação de tempo acima da qual --compare aponta regressão
+DEFAULT_REGRESSION_THRESHOLD = 0.2
+
+
+def start_qgis(profile_folder):
+    # Plataforma offscreen: roda em servidores e integração contínua sem tela.
+    # O perfil temporário evita gravar modelos e registros de tempo no perfil do usuário.
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    app = QgsApplication([], False, profile_folder)
+    app.initQgis()
+    return app
+
+
+def process_peak_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss vem em KB no Linux e em bytes no macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def measure(stage, results, function, *args, trace_memory=False):
+    # O pico do processo (ru_maxrss) só cresce: cada etapa mostra o máximo até ali.
+    # tracemalloc dá o pico do Python por etapa, mas deixa o código mais lento,
+    # então os tempos medidos com ele não são comparáveis aos medidos sem.
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        value = function(*args)
+    finally:
+        seconds = time.perf_counter() - started
+        results[stage] = {'segundos': round(seconds, 4), 'pico_processo_mb': process_peak_mb()}
+        if trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[stage]['pico_python_mb'] = round(peak / (1024 * 1024), 1)
+    return value
+
+
+def synthetic_polygon(center_x, center_y, radius, vertices, rng):
+    # Polígono estrelado irregular com o número de vértices pedido
+    points = []
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        r = radius * rng.uniform(0.6, 1.0)
+        points.append(QgsPointXY(center_x + r * math.cos(angle), center_y + r * math.sin(angle)))
+    points.append(points[0])
+    geometry = QgsGeometry.fromPolygonXY([points])
+    geometry.convertToMultiType()
+    return geometry
+
+
+def fill_property(layers, feature_count, vertices, seed=0):
+    # Imóvel quadrado dividido em células; cada célula recebe um polígono de
+    # cobertura, sem sobreposição entre células
+    rng = random.Random(seed)
+    by_name = {layer.name(): layer for layer in layers}
+    side = max(1, math.ceil(math.sqrt(feature_count)))
+    x0, y0 = ORIGIN
+    x1, y1 = x0 + side * CELL_SIZE, y0 + side * CELL_SIZE
+
+    imovel = by_name['Imóvel']
+    feature = QgsFeature(imovel.fields())
+    feature.setGeometry(QgsGeometry.fromWkt(
+        f'MultiPolygon((({x0} {y0}, {x1} {y0}, {x1} {y1}, {x0} {y1}, {x0} {y0})))'))
+    imovel.dataProvider().addFeatures([feature])
+    sede = by_name['Sede']
+    feature = QgsFeature(sede.fields())
+    feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY((x0 + x1) / 2, (y0 + y1) / 2)))
+    sede.dataProvider().addFeatures([feature])
+
+    targets = [by_name[name] for name in FILL_LAYERS]
+    pending = {layer.id(): [] for layer in targets}
+    for index in range(feature_count):
+        layer = targets[index % len(targets)]
+        row, column = divmod(index, side)
+        feature = QgsFeature(layer.fields())
+        feature.setGeometry(synthetic_polygon(x0 + (column + 0.5) * CELL_SIZE, y0 + (row + 0.5) * CELL_SIZE,
+                                              CELL_SIZE * 0.45, vertices, rng))
+        feature.setAttributes([index, f'Feição {index}', 'Sintética', None])
+        pending[layer.id()].append(feature)
+        if len(pending[layer.id()]) >= ADD_CHUNK_SIZE:
+            layer.dataProvider().addFeatures(pending[layer.id()])
+            pending[layer.id()] = []
+    for layer in targets:
+        layer.dataProvider().addFeatures(pending[layer.id()])
+        layer.updateExtents()
+
+
+def template_creation(structure, results, trace_memory=False):
+    # Caminho usado pelo botão de criação (car_template): geração do modelo .qlr na
+    # primeira vez e carga do modelo em cache nas seguintes, cada uma num projeto novo.
+    # O modelo fica no perfil temporário do benchmark e é apagado antes da geração.
+    path = template_path(structure)
+    if os.path.exists(path):
+        os.remove(path)
+    for stage in ('criacao_modelo', 'criacao_modelo_cache'):
+        project = QgsProject()
+        measure(stage, results, create_car_structure_from_template, project, project.layerTreeRoot(),
+                structure, trace_memory=trace_memory)
+        project.clear()
+
+
+def write_and_compress(jobs, folder, results, trace_memory=False):
+    # Escrita e compactação medidas separadamente, com os mesmos passos da exportação
+    # (shapefile numa pasta temporária em disco, depois copiado para o ZIP)
+    work_root = os.path.join(folder, 'shapefiles')
+    try:
+        def write_all():
+            for job in jobs:
+                os.makedirs(os.path.join(work_root, job.safe_name))
+                write_shapefile(job, os.path.join(work_root, job.safe_name, f"{job.safe_name}.shp"))
+
+        def compress_all():
+            for job in jobs:
+                zip_shapefile(os.path.join(work_root, job.safe_name), job.safe_name,
+                              os.path.join(folder, f"{job.safe_name}.zip"))
+
+        measure('escrita', results, write_all, trace_memory=trace_memory)
+        measure('compactacao', results, compress_all, trace_memory=trace_memory)
+    finally:
+        shutil.rmtree(work_root, ignore_errors=True)
+
+
+def folder_size(folder, extensions=('.zip',)):
+    return sum(os.path.getsize(os.path.join(folder, f)) for f in os.listdir(folder)
+               if f.endswith(extensions))
+
+
+def run_scenario(feature_count, vertices, work_folder, trace_memory=False):
+    results = {}
+    project = QgsProject()
+    structure = build_layer_structure(list(CAR_GROUPS))
+    layers = measure('criacao', results, create_car_structure, project, project.layerTreeRoot(), structure,
+                     trace_memory=trace_memory)
+    template_creation(structure, results, trace_memory)
+    measure('carga', results, fill_property, layers, feature_count, vertices, trace_memory=trace_memory)
+
+    stages_folder = os.path.join(work_folder, f'etapas_{feature_count}_{vertices}')
+    export_folder = os.path.join(work_folder, f'exportacao_{feature_count}_{vertices}')
+    os.makedirs(stages_folder)
+    filled = [layer for layer in layers if layer.featureCount()]
+    jobs = [LayerExportJob(layer, project) for layer in filled]
+    write_and_compress(jobs, stages_folder, results, trace_memory)
+
+    # Exportação completa (impressão digital, escrita, ZIP e manifesto) e, em
+    # seguida, a reexportação sem alterações
+    measure('exportacao', results, export_car_layers, layers, export_folder, project,
+            trace_memory=trace_memory)
+    measure('reexportacao', results, export_car_layers, layers, export_folder, project,
+            trace_memory=trace_memory)
+
+    # Os demais formatos de saída, cada um numa pasta nova (sem camadas a pular)
+    sizes = {}
+    for writer_class in EXPORT_WRITERS[1:]:
+        format_folder = os.path.join(work_folder, f'{writer_class.key}_{feature_count}_{vertices}')
+        measure(f'exportacao_{writer_class.key}', results, export_car_layers, layers, format_folder,
+                project, None, None, writer_class(), trace_memory=trace_memory)
+        sizes[writer_class.key] = folder_size(format_folder, ('.gpkg', '.fgb'))
+        shutil.rmtree(format_folder, ignore_errors=True)
+
+    scenario = {
+        'cenario': f'{feature_count}x{vertices}',
+        'feicoes': feature_count,
+        'vertices_por_feicao': vertices,
+        'memoria_python': trace_memory,
+        'bytes_zip': folder_size(export_folder),
+        'bytes_formatos': sizes,
+        'etapas': results,
+    }
+    project.clear()
+    shutil.rmtree(stages_folder, ignore_errors=True)
+    shutil.rmtree(export_folder, ignore_errors=True)
+    return scenario
+
+
+def environment():
+    return {
+        'momento': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'qgis': Qgis.version(),
+        'gdal': gdal.VersionInfo('RELEASE_NAME'),
+        'python': platform.python_version(),
+        'sistema': platform.platform(),
+        'processadores': os.cpu_count(),
+    }
+
+
+def compare(report, baseline, threshold):
+    # Regressões: etapas do mesmo cenário com tempo maior que a base além do limite
+    base = {s['cenario']: s for s in baseline['cenarios']}
+    regressions = []
+    for scenario in report['cenarios']:
+        previous = base.get(scenario['cenario'])
+        if previous is None:
+            continue
+        for stage, values in scenario['etapas'].items():
+            before = previous['etapas'].get(stage, {}).get('segundos')
+            if before and values['segundos'] > before * (1 + threshold):
+                regressions.append(f"{scenario['cenario']} {stage}: {before:.3f} s -> {values['segundos']:.3f} s")
+    return regressions
+
+
+def print_report(report):
+    stages = ['criacao', 'criacao_modelo', 'criacao_modelo_cache', 'carga', 'escrita', 'compactacao', 'exportacao', 'reexportacao']
+    stages += [f'exportacao_{writer_class.key}' for writer_class in EXPORT_WRITERS[1:]]
+    print(f"{'cenario':>14} " + ' '.join(f'{s[:16]:>16}' for s in stages) + f" {'zip (KB)':>10}")
+    for scenario in report['cenarios']:
+        times = ' '.join(f"{scenario['etapas'][s]['segundos']:>16.3f}" if s in scenario['etapas']
+                         else f"{'-':>16}" for s in stages)
+        print(f"{scenario['cenario']:>14} {times} {scenario['bytes_zip'] / 1024:>10.0f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark do GeoCAR Poupa Tempo em imóveis sintéticos')
+    parser.add_argument('--features', type=int, nargs='+', default=DEFAULT_FEATURES)
+    parser.add_argument('--vertices', type=int, nargs='+', default=DEFAULT_VERTICES)
+    parser.add_argument('--output', help='arquivo JSON com o relatório')
+    parser.add_argument('--compare', help='relatório JSON de referência')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD)
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='mede o pico de memória do Python por etapa (tempos ficam maiores)')
+    args = parser.parse_args(argv)
+
+    regressions = []
+    work_folder = tempfile.mkdtemp(prefix='geocar_benchmark_')
+    app = start_qgis(os.path.join(work_folder, 'perfil'))
+    try:
+        report = {'ambiente': environment(), 'cenarios': []}
+        for feature_count in args.features:
+            for vertices in args.vertices:
+                report['cenarios'].append(run_scenario(feature_count, vertices, work_folder,
+                                                       args.trace_memory))
+        print_report(report)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+        if args.compare:
+            with open(args.compare, encoding='utf-8') as f:
+                regressions = compare(report, json.load(f), args.threshold)
+            for line in regressions:
+                print(f"REGRESSÃO {line}")
+    finally:
+        app.exitQgis()
+        shutil.rmtree(work_folder, ignore_errors=True)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
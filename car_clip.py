@@ -0,0 +1,146 @@
+from qgis.core import (QgsTask, QgsGeometry, QgsFeatureRequest, QgsWkbTypes,
+                       QgsCoordinateTransform, QgsVectorLayerFeatureSource)
+from .car_core import build_layer_structure, iter_structure_layers
+from .car_app import find_car_layer, map_in_threads
+from .car_validation import IMOVEL_LAYER, OUTSIDE_ALLOWED
+
+# Grupos cujas camadas de polígonos são recortadas pelo Imóvel
+CLIP_GROUPS = ['cobertura', 'app', 'reserva']
+
+
+def clip_layer_names():
+    # Camadas de polígonos dos grupos recortados, menos as que podem ficar fora do imóvel
+    structure = build_layer_structure(CLIP_GROUPS)
+    return [layer_name for path, layer_name, geom_type in iter_structure_layers(structure)
+            if geom_type == 'MultiPolygon' and layer_name not in OUTSIDE_ALLOWED]
+
+
+def clip_features(source, imovel_wkb, multi, is_canceled=None):
+    # Roda numa thread de trabalho, uma camada por vez. Cada camada usa sua própria
+    # geometria preparada (o GEOS não compartilha a preparação entre threads).
+    imovel = QgsGeometry()
+    imovel.fromWkb(imovel_wkb)
+    bbox = imovel.boundingBox()
+    engine = QgsGeometry.createGeometryEngine(imovel.constGet())
+    engine.prepareGeometry()
+
+    changes = {}
+    deleted = []
+    for feature in source.getFeatures(QgsFeatureRequest().setNoAttributes()):
+        if is_canceled and is_canceled():
+            break
+        geometry = feature.geometry()
+        if geometry.isNull() or geometry.isEmpty():
+            continue
+        # Retângulo envolvente primeiro: feições longe do imóvel saem sem teste do GEOS
+        if not geometry.boundingBox().intersects(bbox):
+            deleted.append(feature.id())
+            continue
+        if engine.contains(geometry.constGet()):
+            continue
+        if not engine.intersects(geometry.constGet()):
+            deleted.append(feature.id())
+            continue
+        clipped = geometry.intersection(imovel)
+        # Sobras de linhas ou pontos no limite do imóvel não entram em camadas de polígonos
+        clipped.convertGeometryCollectionToSubclass(QgsWkbTypes.PolygonGeometry)
+        if clipped.isNull() or clipped.isEmpty():
+            deleted.append(feature.id())
+            continue
+        if multi:
+            clipped.convertToMultiType()
+        changes[feature.id()] = clipped
+    return changes, deleted
+
+
+class ClipSource:
+    # Retrato de uma camada do CAR para leitura em segundo plano
+    def __init__(self, layer):
+        self.layer_name = layer.name()
+        self.source = QgsVectorLayerFeatureSource(layer)
+        self.crs = layer.crs()
+        self.multi = QgsWkbTypes.isMultiType(layer.wkbType())
+
+
+class ClipTask(QgsTask):
+    def __init__(self, imovel_layer, layers, project):
+        super().__init__("GeoCAR Poupa Tempo: recorte pelo Imóvel", QgsTask.CanCancel)
+        self.context = project.transformContext()
+        self.imovel = ClipSource(imovel_layer)
+        self.sources = [ClipSource(layer) for layer in layers]
+        self.results = {}
+        self.error = None
+
+    def run(self):
+        try:
+            return self.clip()
+        except Exception as e:
+            self.error = str(e)
+            return False
+
+    def imovel_wkb(self, crs, cache):
+        # Imóvel unido e levado ao CRS da camada uma única vez por CRS
+        key = crs.authid() or crs.toWkt()
+        if key not in cache:
+            imovel = QgsGeometry(cache[None])
+            if crs != self.imovel.crs:
+                imovel.transform(QgsCoordinateTransform(self.imovel.crs, crs, self.context))
+            cache[key] = imovel.asWkb()
+        return cache[key]
+
+    def clip(self):
+        parts = [f.geometry() for f in self.imovel.source.getFeatures(QgsFeatureRequest().setNoAttributes())
+                 if f.hasGeometry()]
+        if not parts:
+            raise RuntimeError('A camada Imóvel está vazia')
+        cache = {None: QgsGeometry.unaryUnion(parts)}
+        work = [(source, self.imovel_wkb(source.crs, cache)) for source in self.sources]
+
+        results = map_in_threads(
+            self, lambda item: clip_features(item[0].source, item[1], item[0].multi, self.isCanceled), work)
+        if results is None:
+            return False
+        for source, result in zip(self.sources, results):
+            self.results[source.layer_name] = result
+        return True
+
+
+def clip_candidates(project, log=None):
+    # Camadas do CAR com feições a recortar; camadas em edição ficam de fora porque a
+    # gravação vai direto ao provedor
+    layers = []
+    for layer_name in clip_layer_names():
+        layer = find_car_layer(project, layer_name)
+        if layer is None or not layer.featureCount():
+            continue
+        if layer.isEditable():
+            if log:
+                log(f"Camada em edição, não recortada: {layer_name}")
+            continue
+        layers.append(layer)
+    return layers
+
+
+def apply_clip_results(project, task, log=None):
+    # Roda na thread principal, depois da tarefa: regrava as camadas no lugar
+    total_changed = total_deleted = 0
+    for layer_name, (changes, deleted) in task.results.items():
+        if not changes and not deleted:
+            continue
+        layer = find_car_layer(project, layer_name)
+        if layer is None:
+            continue
+        provider = layer.dataProvider()
+        if changes:
+            provider.changeGeometryValues(changes)
+        if deleted:
+            provider.deleteFeatures(deleted)
+        layer.updateExtents()
+        layer.triggerRepaint()
+        total_changed += len(changes)
+        total_deleted += len(deleted)
+        if log:
+            log(f"{layer_name}: {len(changes)} feição(ões) recortada(s), {len(deleted)} fora do imóvel removida(s)")
+    if log:
+        log(f"Recorte pelo {IMOVEL_LAYER}: {len(task.results)} camada(s) verificada(s), "
+            f"{total_changed} feição(ões) recortada(s), {total_deleted} removida(s)")
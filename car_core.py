@@ -0,0 +1,515 @@
+import os
+import re
+import json
+import time
+import hashlib
+import unicodedata
+from osgeo import gdal
+from qgis.core import (QgsProject, QgsVectorLayer, QgsField, QgsFeature, QgsFeatureRequest,
+                       QgsDataProvider, QgsWkbTypes, QgsLayerTree, QgsLayerTreeGroup,
+                       QgsLayerTreeLayer)
+from PyQt5.QtCore import QVariant
+from .car_export import (LayerExportJob, ExportCanceled, safe_file_name,
+                         export_layer_job, export_writer, remove_partial_files, TransformCache)
+from .car_manifest import resume_manifest, save_manifest, clear_journal
+from .car_log import record_timing
+from .car_groups import CAR_GROUPS
+
+# Versão do esquema das camadas do CAR; incrementar quando mudar algo que não
+# esteja em CAR_GROUPS ou CAR_FIELDS_URI (ex.: estilos ou propriedades das camadas)
+SCHEMA_VERSION = 2
+
+# Formatos aceitos como fonte de dados de um imóvel
+SOURCE_EXTENSIONS = ('.shp', '.gpkg', '.geojson', '.json', '.kml', '.kmz', '.gml')
+
+# Pacotes (ex.: ZIPs baixados do SICAR), lidos pelo GDAL sem extrair
+PACKAGE_EXTENSIONS = ('.zip',)
+
+# Feições por chamada a addFeatures na cópia para as camadas do CAR
+IMPORT_CHUNK_SIZE = 5000
+
+# Nomes das camadas nos shapefiles baixados do SICAR (layer_key) -> camada do CAR,
+# para os que não coincidem com o nome da camada (AREA_CONSOLIDADA já coincide).
+# A Reserva Legal do SICAR entra como proposta, a situação de um novo cadastro.
+SICAR_LAYER_ALIASES = {
+    'area_imovel': 'Imóvel',
+    'sede_imovel': 'Sede',
+    'vegetacao_nativa': 'Remanescente de Vegetação Nativa',
+    'remanescente_vegetacao_nativa': 'Remanescente de Vegetação Nativa',
+    'area_pousio': 'Área de Pousio',
+    'area_regeneracao': 'Área de Regeneração',
+    'reserva_legal': 'Reserva Legal Proposta',
+    'reserva_legal_averbada': 'Reserva Legal Averbada',
+    'nascente_olho_dagua': 'Nascente ou olho d\'agua perene',
+}
+
+# Camadas do SICAR que reúnem várias camadas do CAR (ex.: todas as classes de APP)
+# e precisam ser distribuídas à mão
+SICAR_SHARED_LAYERS = {'app', 'apps', 'area_preservacao_permanente', 'uso_restrito',
+                       'area_uso_restrito', 'servidao_administrativa'}
+
+# Propriedades que registram as camadas criadas pelo plugin: caminho do grupo
+# na estrutura do CAR e esquema com que a camada foi criada
+GROUP_PATH_PROPERTY = 'geocar/grupo'
+SCHEMA_PROPERTY = 'geocar/esquema'
+
+
+def parse_groups(value):
+    # Aceita "imovel,app" ou uma lista; vazio significa todos os grupos
+    if not value:
+        return list(CAR_GROUPS)
+    if isinstance(value, str):
+        value = value.replace(';', ',').split(',')
+    groups = [g.strip().lower() for g in value if g.strip()]
+    unknown = [g for g in groups if g not in CAR_GROUPS]
+    if unknown:
+        raise ValueError(f"Grupos desconhecidos: {', '.join(unknown)}")
+    return groups
+
+
+def build_layer_structure(groups):
+    # Estrutura de grupos e camadas
+    layer_structure = {}
+    for key in CAR_GROUPS:
+        if key in groups:
+            group_name, content = CAR_GROUPS[key]
+            layer_structure[group_name] = content
+    return layer_structure
+
+
+def count_total_items(structure):
+    count = 0
+    for name, content in structure.items():
+        if isinstance(content, dict):
+            count += count_total_items(content)
+        else:
+            geom_types = content if isinstance(content, list) else [content]
+            count += len(geom_types)
+    return count
+
+
+def iter_structure_layers(structure, path=()):
+    # Percorre a estrutura devolvendo (caminho do grupo, nome da camada, tipo de geometria)
+    for name, content in structure.items():
+        if isinstance(content, dict):
+            yield from iter_structure_layers(content, path + (name,))
+        else:
+            geom_types = content if isinstance(content, list) else [content]
+            for geom_type in geom_types:
+                layer_name = f'{name} ({geom_type})' if len(geom_types) > 1 else name
+                yield path, layer_name, geom_type
+
+
+def car_fields():
+    # Campos básicos de todas as camadas do CAR
+    return [
+        QgsField('id', QVariant.Int),
+        QgsField('nome', QVariant.String, len=255),
+        QgsField('descricao', QVariant.String, len=500),
+        QgsField('data_criacao', QVariant.Date)
+    ]
+
+
+# Os mesmos campos na URI do provedor memory: a camada já nasce com eles,
+# sem addAttributes/updateFields
+CAR_FIELDS_URI = ('field=id:integer&field=nome:string(255)'
+                  '&field=descricao:string(500)&field=data_criacao:date')
+
+
+def schema_id():
+    # Muda sempre que o esquema muda, invalidando modelos e registros antigos
+    content = json.dumps([SCHEMA_VERSION, CAR_GROUPS, CAR_FIELDS_URI], ensure_ascii=False)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()[:12]
+
+
+def tag_car_layer(layer, path):
+    layer.setCustomProperty(GROUP_PATH_PROPERTY, list(path))
+    layer.setCustomProperty(SCHEMA_PROPERTY, schema_id())
+
+
+def is_car_layer(layer):
+    return isinstance(layer, QgsVectorLayer) and bool(layer.customProperty(GROUP_PATH_PROPERTY))
+
+
+def car_layers(project):
+    # Registro das camadas do plugin: só as marcadas por tag_car_layer, sem
+    # varrer nem filtrar as demais camadas do projeto
+    return [layer for layer in project.mapLayers().values() if is_car_layer(layer)]
+
+
+def index_layer_tree(root):
+    # Uma passada pela árvore: {caminho: nó do grupo}, {(caminho, nome): camada} e as
+    # camadas repetidas (mesmo caminho e nome), que ficam fora do índice
+    groups = {(): root}
+    layers = {}
+    duplicates = []
+
+    def walk(group, path):
+        for child in group.children():
+            if QgsLayerTree.isGroup(child):
+                child_path = path + (child.name(),)
+                groups.setdefault(child_path, child)
+                walk(child, child_path)
+            elif QgsLayerTree.isLayer(child) and child.layer() is not None:
+                key = (path, child.layer().name())
+                if key in layers:
+                    duplicates.append(child.layer())
+                else:
+                    layers[key] = child.layer()
+
+    walk(root, ())
+    return groups, layers, duplicates
+
+
+def register_existing_layers(root):
+    # Projetos criados antes do registro: marca as camadas cuja posição na árvore
+    # (grupos e nome) coincide com a estrutura do CAR. Devolve quantas foram marcadas.
+    groups, layers, duplicates = index_layer_tree(root)
+    count = 0
+    for path, layer_name, geom_type in iter_structure_layers(build_layer_structure(list(CAR_GROUPS))):
+        layer = layers.get((path, layer_name))
+        if layer is not None and not is_car_layer(layer):
+            tag_car_layer(layer, path)
+            count += 1
+    return count
+
+
+def create_car_layer(layer_name, geom_type):
+    uri = f'{geom_type}?crs=epsg:4674&{CAR_FIELDS_URI}'
+    layer = QgsVectorLayer(uri, layer_name, 'memory')
+    if not layer.isValid():
+        return None
+    return layer
+
+
+def build_layer_tree(structure, log=None, layer_factory=None):
+    # Monta a árvore fora do projeto: grupos soltos com os nós das camadas.
+    # Nada aqui dispara sinais da árvore de camadas do projeto.
+    layer_factory = layer_factory or create_car_layer
+    top_groups = []
+    layers = []
+
+    def fill_group(group, structure, path):
+        for name, content in structure.items():
+            if isinstance(content, dict):
+                # É um subgrupo
+                fill_group(group.addGroup(name), content, path + (name,))
+            else:
+                # É uma camada
+                geom_types = content if isinstance(content, list) else [content]
+                for geom_type in geom_types:
+                    layer_name = f'{name} ({geom_type})' if len(geom_types) > 1 else name
+                    layer = layer_factory(layer_name, geom_type)
+                    if layer is None:
+                        if log:
+                            log(f'Erro ao criar camada: {layer_name}')
+                        continue
+                    tag_car_layer(layer, path)
+                    layers.append(layer)
+                    group.addChildNode(QgsLayerTreeLayer(layer))
+
+    for name, content in structure.items():
+        group = QgsLayerTreeGroup(name)
+        fill_group(group, content, (name,))
+        top_groups.append(group)
+    return top_groups, layers
+
+
+def create_car_structure(project, root, structure, log=None, progress=None, layer_factory=None):
+    # Cria grupos e camadas na árvore do projeto em lote: todas as camadas são
+    # preparadas antes, registradas com uma única chamada a addMapLayers e os grupos
+    # entram na árvore de uma vez. log e progress são callbacks opcionais;
+    # layer_factory(nome, tipo) troca o provedor memory por outro armazenamento.
+    started = time.perf_counter()
+    top_groups, layers = build_layer_tree(structure, log, layer_factory)
+    if progress:
+        progress(50)
+
+    project.addMapLayers(layers, False)
+    root.insertChildNodes(-1, top_groups)
+    record_timing('criacao', time.perf_counter() - started, camadas=len(layers),
+                  origem='memoria' if layer_factory is None else 'fabrica')
+
+    if log:
+        for group in top_groups:
+            log(f"Criando grupo: {group.name()}")
+        log(f"{len(layers)} camadas criadas em {time.perf_counter() - started:.2f} s")
+    if progress:
+        progress(100)
+    return layers
+
+
+def repair_layer_fields(layer):
+    # Acrescenta à camada existente os campos do CAR que faltam; campos já
+    # existentes não são alterados. Devolve os nomes acrescentados.
+    missing = [field for field in car_fields() if layer.fields().indexOf(field.name()) < 0]
+    if missing and layer.dataProvider().addAttributes(missing):
+        layer.updateFields()
+        return [field.name() for field in missing]
+    return []
+
+
+def ensure_group(groups, path):
+    # Cria na árvore só os grupos do caminho que ainda não existem
+    for depth in range(1, len(path) + 1):
+        group_path = path[:depth]
+        if group_path not in groups:
+            groups[group_path] = groups[group_path[:-1]].addGroup(group_path[-1])
+    return groups[path]
+
+
+def reconcile_car_structure(project, root, structure, log=None, progress=None, layer_factory=None,
+                            repair_fields=False):
+    # Compara a árvore atual com a estrutura desejada e cria só o que falta, sem
+    # duplicar grupos nem camadas. Grupos de primeiro nível ausentes são montados em
+    # lote, como em create_car_structure; nos existentes, entram só as camadas que faltam.
+    started = time.perf_counter()
+    layer_factory = layer_factory or create_car_layer
+    groups, existing, duplicates = index_layer_tree(root)
+
+    missing_top = {name: content for name, content in structure.items() if (name,) not in groups}
+    top_groups, layers = build_layer_tree(missing_top, log, layer_factory)
+
+    placements = []
+    kept = 0
+    repaired = 0
+    present = {name: content for name, content in structure.items() if (name,) in groups}
+    for path, layer_name, geom_type in iter_structure_layers(present):
+        layer = existing.get((path, layer_name))
+        if layer is not None:
+            kept += 1
+            if not is_car_layer(layer):
+                tag_car_layer(layer, path)
+            if repair_fields:
+                added = repair_layer_fields(layer)
+                if added:
+                    repaired += 1
+                    if log:
+                        log(f"Campos acrescentados em {layer_name}: {', '.join(added)}")
+            continue
+        layer = layer_factory(layer_name, geom_type)
+        if layer is None:
+            if log:
+                log(f'Erro ao criar camada: {layer_name}')
+            continue
+        tag_car_layer(layer, path)
+        layers.append(layer)
+        placements.append((path, layer))
+    if progress:
+        progress(50)
+
+    project.addMapLayers(layers, False)
+    for path, layer in placements:
+        ensure_group(groups, path).addLayer(layer)
+    root.insertChildNodes(-1, top_groups)
+    record_timing('reconciliacao', time.perf_counter() - started, criadas=len(layers),
+                  existentes=kept, corrigidas=repaired)
+
+    if log:
+        for group in top_groups:
+            log(f"Criando grupo: {group.name()}")
+        if duplicates:
+            log(f"Atenção: {len(duplicates)} camada(s) repetida(s) na árvore: "
+                f"{', '.join(sorted({layer.name() for layer in duplicates}))}")
+        log(f"{len(layers)} camada(s) criada(s), {kept} já existente(s)"
+            + (f", {repaired} com campos corrigidos" if repair_fields else "")
+            + f" em {time.perf_counter() - started:.2f} s")
+    if progress:
+        progress(100)
+    return layers
+
+
+def build_car_layers(structure):
+    # Versão sem projeto: camadas avulsas, usada no modo em lote
+    layers = []
+    for path, layer_name, geom_type in iter_structure_layers(structure):
+        layer = create_car_layer(layer_name, geom_type)
+        if layer is not None:
+            tag_car_layer(layer, path)
+            layers.append(layer)
+    return layers
+
+
+def vector_files(path):
+    # Arquivos vetoriais de um arquivo, pasta ou ZIP. ZIPs (inclusive ZIPs dentro
+    # de ZIPs, como os pacotes de camadas do SICAR) são lidos via /vsizip/.
+    if path.lower().endswith(PACKAGE_EXTENSIONS):
+        base = f"/vsizip/{{{path}}}"
+        entries = [f"{base}/{entry}" for entry in sorted(gdal.ReadDirRecursive(base) or [])]
+    elif os.path.isdir(path):
+        entries = [os.path.join(path, f) for f in sorted(os.listdir(path))]
+    else:
+        return [path]
+
+    files = []
+    for entry in entries:
+        if entry.lower().endswith(PACKAGE_EXTENSIONS):
+            files.extend(vector_files(entry))
+        elif entry.lower().endswith(SOURCE_EXTENSIONS):
+            files.append(entry)
+    return files
+
+
+def source_layers(path):
+    # Lista as camadas vetoriais de um arquivo (inclusive GeoPackage ou KML com
+    # várias camadas), de uma pasta ou de um ZIP com arquivos vetoriais
+    layers = []
+    for file_path in vector_files(path):
+        layer = QgsVectorLayer(file_path, os.path.splitext(os.path.basename(file_path))[0], 'ogr')
+        if not layer.isValid():
+            continue
+        sublayers = layer.dataProvider().subLayers()
+        if len(sublayers) <= 1:
+            layers.append(layer)
+            continue
+        for sublayer in sublayers:
+            sublayer_name = sublayer.split(QgsDataProvider.SUBLAYER_SEPARATOR)[1]
+            sub = QgsVectorLayer(f"{file_path}|layername={sublayer_name}", sublayer_name, 'ogr')
+            if sub.isValid():
+                layers.append(sub)
+    return layers
+
+
+def copy_features(source, target, transform_context=None, feedback=None, log=None):
+    # Copia as feições em blocos de IMPORT_CHUNK_SIZE, reprojetando na leitura para
+    # o CRS da camada do CAR e mapeando campos pelo nome. Só um bloco fica em memória.
+    # Devolve quantas feições foram gravadas; blocos recusados pelo provedor são
+    # informados no log e não entram na conta.
+    target_fields = target.fields()
+    field_map = [(target_fields.indexOf(field.name()), i)
+                 for i, field in enumerate(source.fields())
+                 if target_fields.indexOf(field.name()) >= 0]
+
+    request = QgsFeatureRequest()
+    request.setSubsetOfAttributes([source_index for target_index, source_index in field_map])
+    if source.crs().isValid() and source.crs() != target.crs():
+        request.setDestinationCrs(target.crs(),
+                                  transform_context or QgsProject.instance().transformContext())
+    multi = QgsWkbTypes.isMultiType(target.wkbType())
+    provider = target.dataProvider()
+
+    total = 0
+    chunk = []
+
+    def add_chunk(features):
+        added, _ = provider.addFeatures(features)
+        if added:
+            return len(features)
+        if log:
+            log(f"Falha ao gravar {len(features)} feição(ões) de {source.name()} em "
+                f"{target.name()}: {provider.lastError() or 'erro do provedor'}")
+        return 0
+
+    for src in source.getFeatures(request):
+        if feedback is not None and feedback.isCanceled():
+            break
+        feature = QgsFeature(target_fields)
+        geometry = src.geometry()
+        if multi and not geometry.isNull():
+            geometry.convertToMultiType()
+        feature.setGeometry(geometry)
+        for target_index, source_index in field_map:
+            feature.setAttribute(target_index, src.attribute(source_index))
+        chunk.append(feature)
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            total += add_chunk(chunk)
+            chunk = []
+    if chunk:
+        total += add_chunk(chunk)
+    target.updateExtents()
+    return total
+
+
+def layer_key(name):
+    # Nome seguro (como nos ZIPs exportados), sem acentos e em minúsculas
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii')
+    return safe_file_name(name).lower()
+
+
+def car_layer_index(car_layers):
+    # layer_key -> camadas. Camadas com mais de um tipo de geometria também entram
+    # pelo nome sem o sufixo, ex.: "Utilidade Pública"
+    index = {}
+    for layer in car_layers:
+        name = layer.name()
+        base_name = re.sub(r' \((MultiPolygon|LineString|Point)\)$', '', name)
+        for key in {layer_key(name), layer_key(base_name)}:
+            index.setdefault(key, []).append(layer)
+    return index
+
+
+def match_car_layer(index, source):
+    key = layer_key(source.name())
+    if key in SICAR_LAYER_ALIASES:
+        key = layer_key(SICAR_LAYER_ALIASES[key])
+    candidates = index.get(key, [])
+    if len(candidates) <= 1:
+        return candidates[0] if candidates else None
+    # Mesmo nome em camadas de geometrias diferentes: decide pelo tipo da fonte
+    for layer in candidates:
+        if layer.geometryType() == source.geometryType():
+            return layer
+    return None
+
+
+def load_source_data(car_layers, path, log=None, transform_context=None, feedback=None):
+    # Preenche as camadas do CAR com as camadas da fonte cujo nome corresponde
+    index = car_layer_index(car_layers)
+    total = 0
+    for source in source_layers(path):
+        if feedback is not None and feedback.isCanceled():
+            break
+        target = match_car_layer(index, source)
+        if target is None:
+            if log and layer_key(source.name()) in SICAR_SHARED_LAYERS:
+                log(f"Camada do SICAR com mais de uma camada do CAR correspondente, "
+                    f"carregue manualmente: {source.name()}")
+            elif log:
+                log(f"Camada da fonte sem correspondente no CAR: {source.name()}")
+            continue
+        if target.isEditable():
+            # A cópia vai direto ao provedor e passaria por cima do buffer de edição
+            if log:
+                log(f"Camada em edição, não importada: {target.name()}")
+            continue
+        count = copy_features(source, target, transform_context, feedback, log)
+        total += count
+        if log:
+            log(f"{count} feições carregadas em {target.name()}")
+    return total
+
+
+def export_car_layers(layers, car_folder, project=None, log=None, feedback=None, writer=None):
+    # Exportação síncrona (sem QgsTask), usada pelos algoritmos de processamento
+    project = project or QgsProject.instance()
+    writer = writer or export_writer()
+    if not os.path.exists(car_folder):
+        os.makedirs(car_folder)
+
+    remove_partial_files(car_folder)
+    manifest, resumed = resume_manifest(car_folder)
+    if resumed and log:
+        log(f"Retomando exportação interrompida: {resumed} camada(s) já concluída(s)")
+    exported, skipped, failed = [], [], []
+    transforms = TransformCache(project.transformContext())
+    for index, layer in enumerate(layers):
+        if feedback is not None and feedback.isCanceled():
+            break
+        job = LayerExportJob(layer, project, transforms=transforms)
+        key = writer.manifest_key(job)
+        try:
+            result = export_layer_job(job, car_folder, manifest.get(key), log, writer=writer)
+        except ExportCanceled:
+            break
+        if result.error:
+            failed.append(job.layer_name)
+            manifest.pop(key, None)
+        else:
+            (skipped if result.skipped else exported).append(job.layer_name)
+            manifest[key] = result.manifest_entry
+        if feedback is not None:
+            feedback.setProgress((index + 1) * 100 / len(layers))
+    save_manifest(car_folder, manifest)
+    if len(exported) + len(skipped) + len(failed) == len(layers):
+        clear_journal(car_folder)
+    return exported, skipped, failed
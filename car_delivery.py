@@ -0,0 +1,200 @@
+import os
+import sys
+import csv
+import time
+import zipfile
+import multiprocessing
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from osgeo import ogr
+from .car_core import CAR_GROUPS, GROUP_PATH_PROPERTY, build_layer_structure, iter_structure_layers
+from .car_export import safe_file_name, car_folder_path
+from .car_ogr_export import export_layer
+
+# Entrega de vários clientes de uma vez: cada cliente é um projeto do QGIS (.qgs/.qgz)
+# ou um GeoPackage do CAR. As camadas são exportadas num pool de processos que
+# usam só GDAL/OGR (car_ogr_export).
+
+DELIVERY_EXTENSIONS = ('.gpkg', '.qgs', '.qgz')
+
+DELIVERY_REPORT_COLUMNS = ['cliente', 'fonte', 'status', 'pasta', 'camadas', 'erros',
+                           'feicoes', 'bytes', 'tempo', 'mensagem']
+
+
+def delivery_sources(folder):
+    return [os.path.join(folder, f) for f in sorted(os.listdir(folder))
+            if f.lower().endswith(DELIVERY_EXTENSIONS)]
+
+
+def client_name_for(path):
+    # "CAR Fulano.gpkg" (car_storage_path) e "Fulano.qgz" viram "Fulano"
+    name = os.path.splitext(os.path.basename(path))[0]
+    if path.lower().endswith('.gpkg') and name.startswith('CAR '):
+        name = name[4:]
+    return name
+
+
+def read_project_xml(path):
+    if path.lower().endswith('.qgz'):
+        with zipfile.ZipFile(path) as archive:
+            member = next(n for n in archive.namelist() if n.lower().endswith('.qgs'))
+            return ET.fromstring(archive.read(member))
+    return ET.parse(path).getroot()
+
+
+def is_registered_layer(maplayer):
+    # Propriedade de registro gravada por tag_car_layer (formato novo e antigo do projeto)
+    properties = maplayer.find('customproperties')
+    if properties is None:
+        return False
+    return any(GROUP_PATH_PROPERTY in (element.get('name'), element.get('key'))
+               for element in properties.iter())
+
+
+def project_car_layers(path):
+    # Lê o .qgs direto, sem QgsProject: [(nome, provedor, arquivo, camada no arquivo)]
+    folder = os.path.dirname(os.path.abspath(path))
+    layers = []
+    for maplayer in read_project_xml(path).iter('maplayer'):
+        if not is_registered_layer(maplayer):
+            continue
+        name = maplayer.findtext('layername', '')
+        provider = maplayer.findtext('provider', '')
+        parts = maplayer.findtext('datasource', '').split('|')
+        source_path = parts[0]
+        if provider == 'ogr' and not os.path.isabs(source_path):
+            source_path = os.path.normpath(os.path.join(folder, source_path))
+        layer_name = next((p.split('=', 1)[1] for p in parts[1:] if p.startswith('layername=')), None)
+        layers.append((name, provider, source_path, layer_name))
+    return layers
+
+
+def geopackage_car_layers(path):
+    # Tabelas do GeoPackage do cliente que correspondem a camadas do CAR
+    known = {safe_file_name(layer_name): layer_name for structure_path, layer_name, geom_type
+             in iter_structure_layers(build_layer_structure(list(CAR_GROUPS)))}
+    dataset = ogr.Open(path)
+    if dataset is None:
+        raise RuntimeError(f"Não foi possível abrir {path}")
+    tables = [dataset.GetLayer(i).GetName() for i in range(dataset.GetLayerCount())]
+    dataset = None
+    return [(known[table], 'ogr', path, table) for table in tables if table in known]
+
+
+def collect_delivery(paths, output_folder):
+    # Roda no processo principal: monta a lista de camadas de cada cliente
+    clients = []
+    for path in paths:
+        client = {'cliente': client_name_for(path), 'fonte': path, 'camadas': [], 'erros': []}
+        client['pasta'] = car_folder_path(client['cliente'], output_folder)
+        try:
+            if path.lower().endswith('.gpkg'):
+                layers = geopackage_car_layers(path)
+            else:
+                layers = project_car_layers(path)
+        except Exception as e:
+            client['erros'].append(str(e))
+            layers = []
+        for name, provider, source_path, layer_name in layers:
+            if provider != 'ogr':
+                # Camadas em memória não ficam gravadas no projeto
+                client['erros'].append(f"{name}: camada sem arquivo ({provider})")
+                continue
+            zip_path = os.path.join(client['pasta'], f"{safe_file_name(name)}.zip")
+            client['camadas'].append((name, source_path, layer_name, zip_path))
+        if not layers and not client['erros']:
+            client['erros'].append('Nenhuma camada do CAR encontrada')
+        clients.append(client)
+    return clients
+
+
+def python_executable():
+    # Dentro do QGIS, sys.executable costuma ser o próprio QGIS; os processos de
+    # trabalho precisam do interpretador Python
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        return sys.executable
+    if os.name == 'nt':
+        candidates = [os.path.join(sys.exec_prefix, 'pythonw.exe'),
+                      os.path.join(sys.exec_prefix, 'python.exe')]
+    else:
+        candidates = [os.path.join(sys.exec_prefix, 'bin', f'python{sys.version_info[0]}.{sys.version_info[1]}'),
+                      os.path.join(sys.exec_prefix, 'bin', 'python3')]
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return candidate
+    return sys.executable
+
+
+def run_delivery(clients, workers=0, log=None, feedback=None):
+    # Uma tarefa por camada, para equilibrar clientes grandes e pequenos no pool
+    started = time.perf_counter()
+    for client in clients:
+        client['resultados'] = []
+        if client['camadas']:
+            os.makedirs(client['pasta'], exist_ok=True)
+
+    tasks = [(client, layer) for client in clients for layer in client['camadas']]
+    if tasks:
+        context = multiprocessing.get_context('spawn')
+        context.set_executable(python_executable())
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), mp_context=context) as executor:
+            futures = {executor.submit(export_layer, source_path, layer_name, zip_path): (client, name, zip_path)
+                       for client, (name, source_path, layer_name, zip_path) in tasks}
+            for done, future in enumerate(as_completed(futures), 1):
+                if feedback is not None and feedback.isCanceled():
+                    for pending in futures:
+                        pending.cancel()
+                    break
+                client, name, zip_path = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # Processo de trabalho encerrado (ex.: BrokenProcessPool por falta de
+                    # memória): vira erro da camada e a entrega dos demais clientes segue
+                    result = {'zip': zip_path, 'feicoes': 0, 'bytes': 0, 'segundos': 0,
+                              'erro': str(e) or type(e).__name__}
+                result['camada'] = name
+                client['resultados'].append(result)
+                if log and result['erro']:
+                    log(f"{client['cliente']} / {name}: {result['erro']}")
+                if feedback is not None:
+                    feedback.setProgress(done * 100 / len(tasks))
+
+    results = [delivery_result(client) for client in clients]
+    if log:
+        ok = sum(1 for r in results if r['status'] == 'ok')
+        log(f"{ok} de {len(results)} cliente(s) entregues sem erros em {time.perf_counter() - started:.1f} s")
+    return results
+
+
+def delivery_result(client):
+    layer_errors = [f"{r['camada']}: {r['erro']}" for r in client['resultados'] if r['erro']]
+    errors = client['erros'] + layer_errors
+    exported = [r for r in client['resultados'] if not r['erro']]
+    if not exported:
+        status = 'erro'
+    elif errors or len(client['resultados']) < len(client['camadas']):
+        status = 'parcial'
+    else:
+        status = 'ok'
+    return {
+        'cliente': client['cliente'],
+        'fonte': client['fonte'],
+        'status': status,
+        'pasta': client['pasta'] if exported else '',
+        'camadas': len(exported),
+        'erros': len(errors),
+        'feicoes': sum(r['feicoes'] for r in exported),
+        'bytes': sum(r['bytes'] for r in exported),
+        'tempo': round(sum(r['segundos'] for r in client['resultados']), 3),
+        'mensagem': '; '.join(errors),
+    }
+
+
+def write_delivery_report(path, results):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=DELIVERY_REPORT_COLUMNS, extrasaction='ignore', delimiter=';')
+        writer.writeheader()
+        for result in results:
+            writer.writerow(result)
@@ -0,0 +1,217 @@
+import math
+import numpy as np
+from osgeo import gdal, ogr
+from qgis.core import (QgsTask, QgsGeometry, QgsFeatureRequest, QgsRectangle,
+                       QgsCoordinateReferenceSystem, QgsCoordinateTransform,
+                       QgsVectorLayerFeatureSource)
+from .car_export import TARGET_CRS
+from .car_app import find_car_layer, map_in_threads, skip_editing, write_generated_features
+
+# Camadas do CAR derivadas do modelo digital de elevação
+SLOPE_25_45_LAYER = 'Área de Uso Restrito para declividade de 25 a 45 graus'
+SLOPE_45_LAYER = 'Área de declividade maior que 45 graus'
+ALTITUDE_LAYER = 'Área com altitude superior a 1.800 metros'
+
+# Códigos das classes nos rasters polygonizados
+CLASS_SLOPE_25_45 = 1
+CLASS_SLOPE_45 = 2
+CLASS_ALTITUDE = 3
+
+CLASS_LAYERS = {
+    CLASS_SLOPE_25_45: SLOPE_25_45_LAYER,
+    CLASS_SLOPE_45: SLOPE_45_LAYER,
+    CLASS_ALTITUDE: ALTITUDE_LAYER,
+}
+
+ALTITUDE_LIMIT = 1800
+
+GENERATED_DESCRIPTION = 'Gerada a partir do MDE'
+
+# Tamanho do bloco (pixels) lido por vez; a memória usada é limitada por
+# TILE_SIZE² x número de threads
+TILE_SIZE = 512
+
+# Metros por grau de latitude (aproximação usada para MDE em coordenadas geográficas)
+METERS_PER_DEGREE = 111320.0
+
+
+def pixel_window(geotransform, raster_x, raster_y, rect):
+    # Janela de pixels (x, y, largura, altura) que cobre o retângulo, limitada ao raster
+    x0 = max(0, int(math.floor((rect.xMinimum() - geotransform[0]) / geotransform[1])))
+    x1 = min(raster_x, int(math.ceil((rect.xMaximum() - geotransform[0]) / geotransform[1])))
+    y0 = max(0, int(math.floor((rect.yMaximum() - geotransform[3]) / geotransform[5])))
+    y1 = min(raster_y, int(math.ceil((rect.yMinimum() - geotransform[3]) / geotransform[5])))
+    return x0, y0, max(0, x1 - x0), max(0, y1 - y0)
+
+
+def tile_windows(x, y, width, height):
+    for tile_y in range(y, y + height, TILE_SIZE):
+        for tile_x in range(x, x + width, TILE_SIZE):
+            yield (tile_x, tile_y, min(TILE_SIZE, x + width - tile_x),
+                   min(TILE_SIZE, y + height - tile_y))
+
+
+def tile_rectangle(geotransform, window):
+    x, y, width, height = window
+    x_min = geotransform[0] + x * geotransform[1]
+    y_max = geotransform[3] + y * geotransform[5]
+    return QgsRectangle(x_min, y_max + height * geotransform[5], x_min + width * geotransform[1], y_max)
+
+
+def polygonize(classes, geotransform, projection):
+    # Converte um raster de classes (0 = fora) em geometrias WKB por classe
+    height, width = classes.shape
+    raster = gdal.GetDriverByName('MEM').Create('', width, height, 1, gdal.GDT_Byte)
+    raster.SetGeoTransform(geotransform)
+    raster.SetProjection(projection)
+    band = raster.GetRasterBand(1)
+    band.WriteArray(classes)
+
+    vector = ogr.GetDriverByName('Memory').CreateDataSource('')
+    layer = vector.CreateLayer('classes', geom_type=ogr.wkbPolygon)
+    layer.CreateField(ogr.FieldDefn('classe', ogr.OFTInteger))
+    gdal.Polygonize(band, band, layer, 0, [])
+
+    result = {}
+    for feature in layer:
+        result.setdefault(feature.GetField(0), []).append(bytes(feature.GetGeometryRef().ExportToWkb()))
+    return result
+
+
+def process_tile(dem_path, window, geographic, is_canceled=None):
+    # Roda numa thread de trabalho com seu próprio handle do GDAL. Lê o bloco com
+    # uma borda de 1 pixel para o cálculo da declividade não falhar nas emendas.
+    if is_canceled and is_canceled():
+        return {}
+    dataset = gdal.Open(dem_path)
+    band = dataset.GetRasterBand(1)
+    geotransform = dataset.GetGeoTransform()
+    x, y, width, height = window
+    read_x, read_y = max(0, x - 1), max(0, y - 1)
+    read_width = min(dataset.RasterXSize, x + width + 1) - read_x
+    read_height = min(dataset.RasterYSize, y + height + 1) - read_y
+
+    elevation = band.ReadAsArray(read_x, read_y, read_width, read_height).astype(np.float32)
+    nodata = band.GetNoDataValue()
+    if nodata is not None:
+        elevation[elevation == nodata] = np.nan
+
+    pixel_x, pixel_y = geotransform[1], abs(geotransform[5])
+    if geographic:
+        latitude = geotransform[3] + (y + height / 2) * geotransform[5]
+        pixel_x *= METERS_PER_DEGREE * math.cos(math.radians(latitude))
+        pixel_y *= METERS_PER_DEGREE
+
+    gradient_y, gradient_x = np.gradient(elevation, pixel_y, pixel_x)
+    slope = np.degrees(np.arctan(np.hypot(gradient_x, gradient_y)))
+
+    # Remove a borda extra
+    core = (slice(y - read_y, y - read_y + height), slice(x - read_x, x - read_x + width))
+    slope = slope[core]
+    elevation = elevation[core]
+
+    slope_classes = np.zeros(slope.shape, dtype=np.uint8)
+    with np.errstate(invalid='ignore'):
+        slope_classes[(slope >= 25) & (slope <= 45)] = CLASS_SLOPE_25_45
+        slope_classes[slope > 45] = CLASS_SLOPE_45
+        altitude_classes = np.where(elevation > ALTITUDE_LIMIT, CLASS_ALTITUDE, 0).astype(np.uint8)
+
+    tile_geotransform = (geotransform[0] + x * geotransform[1], geotransform[1], 0,
+                         geotransform[3] + y * geotransform[5], 0, geotransform[5])
+    projection = dataset.GetProjection()
+    dataset = None
+    if is_canceled and is_canceled():
+        return {}
+    result = polygonize(slope_classes, tile_geotransform, projection)
+    if altitude_classes.any():
+        result.update(polygonize(altitude_classes, tile_geotransform, projection))
+    return result
+
+
+class DemGenerationTask(QgsTask):
+    def __init__(self, imovel_layer, dem_layer, project):
+        super().__init__("GeoCAR Poupa Tempo: declividade e altitude", QgsTask.CanCancel)
+        self.context = project.transformContext()
+        self.imovel_source = QgsVectorLayerFeatureSource(imovel_layer)
+        self.imovel_crs = imovel_layer.crs()
+        self.dem_path = dem_layer.source()
+        self.dem_crs = dem_layer.crs()
+        self.results = {}
+        self.tiles = 0
+        self.error = None
+
+    def run(self):
+        try:
+            return self.generate()
+        except Exception as e:
+            self.error = str(e)
+            return False
+
+    def generate(self):
+        # Imóvel no CRS do MDE, para escolher só os blocos que o cruzam
+        request = QgsFeatureRequest().setNoAttributes()
+        if self.imovel_crs != self.dem_crs:
+            request.setDestinationCrs(self.dem_crs, self.context)
+        parts = [f.geometry() for f in self.imovel_source.getFeatures(request) if f.hasGeometry()]
+        if not parts:
+            raise RuntimeError('A camada Imóvel está vazia')
+        imovel = QgsGeometry.unaryUnion(parts)
+        engine = QgsGeometry.createGeometryEngine(imovel.constGet())
+        engine.prepareGeometry()
+
+        dataset = gdal.Open(self.dem_path)
+        if dataset is None:
+            raise RuntimeError(f"Não foi possível abrir o MDE: {self.dem_path}")
+        geotransform = dataset.GetGeoTransform()
+        if geotransform[2] or geotransform[4]:
+            raise RuntimeError('MDE rotacionado não é suportado')
+        window = pixel_window(geotransform, dataset.RasterXSize, dataset.RasterYSize, imovel.boundingBox())
+        dataset = None
+
+        windows = [w for w in tile_windows(*window)
+                   if engine.intersects(QgsGeometry.fromRect(tile_rectangle(geotransform, w)).constGet())]
+        self.tiles = len(windows)
+        if not windows:
+            raise RuntimeError('O MDE não cobre o imóvel')
+
+        geographic = self.dem_crs.isGeographic()
+        per_class = {}
+        tiles = map_in_threads(self, lambda w: process_tile(self.dem_path, w, geographic, self.isCanceled),
+                               windows, progress_share=90)
+        if tiles is None:
+            return False
+        for tile_result in tiles:
+            for class_code, wkbs in tile_result.items():
+                per_class.setdefault(class_code, []).extend(wkbs)
+
+        # Junta os polígonos dos blocos, recorta pelo Imóvel e leva para SIRGAS 2000
+        to_target = QgsCoordinateTransform(self.dem_crs, QgsCoordinateReferenceSystem(TARGET_CRS),
+                                           self.context)
+        for class_code, wkbs in per_class.items():
+            geometries = []
+            for wkb in wkbs:
+                geometry = QgsGeometry()
+                geometry.fromWkb(wkb)
+                geometries.append(geometry)
+            merged = QgsGeometry.unaryUnion(geometries).intersection(imovel)
+            if merged.isEmpty():
+                continue
+            merged.transform(to_target)
+            self.results[CLASS_LAYERS[class_code]] = merged
+        return not self.isCanceled()
+
+
+def apply_dem_results(project, task, log=None):
+    # Roda na thread principal: grava nas três camadas do CAR (vazias se não houver área)
+    for layer_name in CLASS_LAYERS.values():
+        layer = find_car_layer(project, layer_name)
+        if layer is None:
+            if log:
+                log(f"Camada não encontrada no projeto: {layer_name}")
+            continue
+        if skip_editing(layer, log):
+            continue
+        geometry = task.results.get(layer_name)
+        count = write_generated_features(layer, [geometry] if geometry else [], GENERATED_DESCRIPTION)
+        if log:
+            log(f"{layer_name}: {count} polígono(s)")
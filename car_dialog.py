@@ -1,9 +1,15 @@
 import os
 from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QPushButton, 
                              QLabel, QProgressBar, QTextEdit, QGroupBox, 
-                             QCheckBox, QFrame, QScrollArea, QWidget, QLineEdit)
+                             QCheckBox, QFrame, QScrollArea, QWidget, QLineEdit,
+                             QTableWidget, QTableWidgetItem, QHeaderView,
+                             QSpinBox, QDoubleSpinBox, QComboBox)
 from PyQt5.QtCore import Qt, QThread, pyqtSignal
 from PyQt5.QtGui import QFont, QPixmap, QPalette, QColor
+from qgis.core import QgsMapLayerProxyModel, QgsFieldProxyModel
+from qgis.gui import QgsMapLayerComboBox, QgsFieldComboBox
+from .car_log import LogSink
+from .car_formats import EXPORT_FORMATS
 
 class CarDialog(QDialog):
     def __init__(self, parent=None):
@@ -209,6 +215,9 @@ class CarDialog(QDialog):
         log_layout.addWidget(self.log_text)
         log_group.setLayout(log_layout)
         main_layout.addWidget(log_group)
+        
+        # Log e progresso chegam em rajadas; os widgets são atualizados em lote
+        self.log_sink = LogSink(self.log_text, self.progress_bar, parent=self)
 
         # Buttons
         button_layout = QHBoxLayout()
@@ -219,11 +228,16 @@ class CarDialog(QDialog):
         self.export_btn = QPushButton("Exportar Camadas")
         self.export_btn.setEnabled(False)
         
+        self.cancel_btn = QPushButton("Cancelar")
+        self.cancel_btn.setProperty("class", "secondary-button")
+        self.cancel_btn.setVisible(False)
+        
         self.close_btn = QPushButton("Fechar")
         self.close_btn.setProperty("class", "secondary-button")
         
         button_layout.addWidget(self.create_layers_btn)
         button_layout.addWidget(self.export_btn)
+        button_layout.addWidget(self.cancel_btn)
         button_layout.addStretch()
         button_layout.addWidget(self.close_btn)
         
@@ -232,8 +246,7 @@ class CarDialog(QDialog):
         self.setLayout(main_layout)
 
         # Connect signals
-        self.create_layers_btn.clicked.connect(self.create_layers)
-        self.export_btn.clicked.connect(self.export_layers)
+        # Criação e exportação são conectadas pelo plugin (CarPaPoupaTempo)
         self.close_btn.clicked.connect(self.close)
 
     def create_layer_groups(self, layout):
@@ -282,6 +295,156 @@ class CarDialog(QDialog):
         reserva_group.setLayout(reserva_layout)
         layout.addWidget(reserva_group)
 
+        # Quadro de áreas, atualizado conforme as camadas são editadas
+        areas_group = QGroupBox("Quadro de Áreas")
+        areas_layout = QVBoxLayout()
+        self.area_table = QTableWidget(0, 2)
+        self.area_table.setHorizontalHeaderLabels(["Classe", "Área (ha)"])
+        self.area_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.area_table.verticalHeader().setVisible(False)
+        self.area_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.area_table.setMinimumHeight(200)
+        areas_layout.addWidget(self.area_table)
+        areas_group.setLayout(areas_layout)
+        layout.addWidget(areas_group)
+
+        # Importação de um CAR existente (retificação)
+        import_group = QGroupBox("Importar CAR Existente")
+        import_layout = QHBoxLayout()
+        self.import_file_btn = QPushButton("Importar ZIP/arquivo")
+        self.import_folder_btn = QPushButton("Importar pasta")
+        import_layout.addWidget(self.import_file_btn)
+        import_layout.addWidget(self.import_folder_btn)
+        import_group.setLayout(import_layout)
+        layout.addWidget(import_group)
+
+        # Geração automática de APP a partir da hidrografia
+        app_generation_group = QGroupBox("Geração de APP")
+        app_generation_layout = QVBoxLayout()
+        
+        rivers_layout = QHBoxLayout()
+        rivers_layout.addWidget(QLabel("Cursos d'água:"))
+        self.rivers_combo = QgsMapLayerComboBox()
+        self.rivers_combo.setFilters(QgsMapLayerProxyModel.LineLayer | QgsMapLayerProxyModel.PolygonLayer)
+        self.rivers_combo.setAllowEmptyLayer(True)
+        rivers_layout.addWidget(self.rivers_combo)
+        app_generation_layout.addLayout(rivers_layout)
+        
+        width_layout = QHBoxLayout()
+        width_layout.addWidget(QLabel("Campo de largura (m):"))
+        self.width_field_combo = QgsFieldComboBox()
+        self.width_field_combo.setFilters(QgsFieldProxyModel.Numeric)
+        self.width_field_combo.setAllowEmptyFieldName(True)
+        self.width_field_combo.setLayer(self.rivers_combo.currentLayer())
+        self.rivers_combo.layerChanged.connect(self.width_field_combo.setLayer)
+        width_layout.addWidget(self.width_field_combo)
+        app_generation_layout.addLayout(width_layout)
+        
+        springs_layout = QHBoxLayout()
+        springs_layout.addWidget(QLabel("Nascentes:"))
+        self.springs_combo = QgsMapLayerComboBox()
+        self.springs_combo.setFilters(QgsMapLayerProxyModel.PointLayer)
+        self.springs_combo.setAllowEmptyLayer(True)
+        springs_layout.addWidget(self.springs_combo)
+        app_generation_layout.addLayout(springs_layout)
+        
+        self.generate_app_btn = QPushButton("Gerar APP")
+        app_generation_layout.addWidget(self.generate_app_btn)
+        app_generation_group.setLayout(app_generation_layout)
+        layout.addWidget(app_generation_group)
+
+        # Declividade e altitude a partir do modelo digital de elevação
+        dem_group = QGroupBox("Relevo (MDE)")
+        dem_layout = QVBoxLayout()
+        dem_layer_layout = QHBoxLayout()
+        dem_layer_layout.addWidget(QLabel("Modelo digital de elevação:"))
+        self.dem_combo = QgsMapLayerComboBox()
+        self.dem_combo.setFilters(QgsMapLayerProxyModel.RasterLayer)
+        self.dem_combo.setAllowEmptyLayer(True)
+        dem_layer_layout.addWidget(self.dem_combo)
+        dem_layout.addLayout(dem_layer_layout)
+        self.generate_dem_btn = QPushButton("Gerar declividade e altitude")
+        dem_layout.addWidget(self.generate_dem_btn)
+        dem_group.setLayout(dem_layout)
+        layout.addWidget(dem_group)
+
+        # Recorte das camadas de cobertura, APP/Uso Restrito e Reserva Legal pelo Imóvel
+        clip_group = QGroupBox("Recorte pelo Imóvel")
+        clip_layout = QVBoxLayout()
+        self.clip_btn = QPushButton("Recortar camadas pelo Imóvel")
+        clip_layout.addWidget(self.clip_btn)
+        clip_group.setLayout(clip_layout)
+        layout.addWidget(clip_group)
+
+        # Armazenamento das camadas
+        storage_group = QGroupBox("Armazenamento")
+        storage_layout = QVBoxLayout()
+        self.gpkg_storage_check = QCheckBox("Gravar camadas em GeoPackage do cliente (em vez da memória)")
+        self.gpkg_storage_check.setChecked(False)
+        storage_layout.addWidget(self.gpkg_storage_check)
+        self.repair_fields_check = QCheckBox("Corrigir campos das camadas existentes")
+        self.repair_fields_check.setChecked(False)
+        storage_layout.addWidget(self.repair_fields_check)
+        storage_group.setLayout(storage_layout)
+        layout.addWidget(storage_group)
+
+        # Vários imóveis no mesmo projeto, um grupo "CAR <cliente>" por imóvel
+        session_group = QGroupBox("Imóveis da Sessão")
+        session_layout = QVBoxLayout()
+        session_select_layout = QHBoxLayout()
+        session_select_layout.addWidget(QLabel("Imóvel:"))
+        self.session_combo = QComboBox()
+        session_select_layout.addWidget(self.session_combo)
+        self.activate_session_btn = QPushButton("Ativar")
+        session_select_layout.addWidget(self.activate_session_btn)
+        session_layout.addLayout(session_select_layout)
+        self.add_session_btn = QPushButton("Adicionar imóvel (nome do cliente e grupos selecionados)")
+        session_layout.addWidget(self.add_session_btn)
+        session_group.setLayout(session_layout)
+        layout.addWidget(session_group)
+
+        # Redução de vértices na exportação (limite de tamanho do SICAR)
+        reduce_group = QGroupBox("Redução de Vértices")
+        reduce_layout = QVBoxLayout()
+        self.reduce_check = QCheckBox("Reduzir vértices antes de exportar")
+        self.reduce_check.setChecked(False)
+        reduce_layout.addWidget(self.reduce_check)
+        
+        decimals_layout = QHBoxLayout()
+        decimals_layout.addWidget(QLabel("Casas decimais das coordenadas:"))
+        self.decimals_spin = QSpinBox()
+        self.decimals_spin.setRange(5, 10)
+        self.decimals_spin.setValue(7)
+        decimals_layout.addWidget(self.decimals_spin)
+        reduce_layout.addLayout(decimals_layout)
+        
+        tolerance_layout = QHBoxLayout()
+        tolerance_layout.addWidget(QLabel("Tolerância de simplificação:"))
+        self.tolerance_spin = QDoubleSpinBox()
+        self.tolerance_spin.setRange(0, 50)
+        self.tolerance_spin.setDecimals(2)
+        self.tolerance_spin.setSingleStep(0.1)
+        self.tolerance_spin.setValue(0.5)
+        self.tolerance_spin.setSuffix(" m")
+        tolerance_layout.addWidget(self.tolerance_spin)
+        reduce_layout.addLayout(tolerance_layout)
+        
+        max_size_layout = QHBoxLayout()
+        max_size_layout.addWidget(QLabel("Tamanho máximo do ZIP:"))
+        self.max_size_spin = QDoubleSpinBox()
+        self.max_size_spin.setRange(0, 1000)
+        self.max_size_spin.setDecimals(1)
+        self.max_size_spin.setSuffix(" MB")
+        self.max_size_spin.setSpecialValueText("Sem limite")
+        max_size_layout.addWidget(self.max_size_spin)
+        reduce_layout.addLayout(max_size_layout)
+        
+        for widget in (self.decimals_spin, self.tolerance_spin, self.max_size_spin):
+            widget.setEnabled(False)
+            self.reduce_check.toggled.connect(widget.setEnabled)
+        reduce_group.setLayout(reduce_layout)
+        layout.addWidget(reduce_group)
+
         # Opção de exportação
         export_group = QGroupBox("Opções de Exportação")
         export_layout = QVBoxLayout()
@@ -295,38 +458,60 @@ class CarDialog(QDialog):
         client_layout.addWidget(self.client_name_input)
         export_layout.addLayout(client_layout)
         
+        # Formato de saída: os ZIPs do SICAR ou um formato mais rápido para arquivo interno
+        format_layout = QHBoxLayout()
+        format_layout.addWidget(QLabel("Formato:"))
+        self.format_combo = QComboBox()
+        for key, label in EXPORT_FORMATS.items():
+            self.format_combo.addItem(label, key)
+        format_layout.addWidget(self.format_combo)
+        export_layout.addLayout(format_layout)
+        
+        self.validate_check = QCheckBox("Validar topologia antes de exportar")
+        self.validate_check.setChecked(True)
+        export_layout.addWidget(self.validate_check)
+        
         self.auto_export_check = QCheckBox("Exportar automaticamente após criação")
         self.auto_export_check.setChecked(False)
         export_layout.addWidget(self.auto_export_check)
         export_group.setLayout(export_layout)
         layout.addWidget(export_group)
 
-    def create_layers(self):
-        self.log_text.append("Iniciando criação de camadas...")
-        self.progress_bar.setVisible(True)
-        self.progress_bar.setValue(0)
-        
-        # Aqui será chamada a função de criação de camadas
-        # Por enquanto, simulamos o progresso
-        for i in range(101):
-            self.progress_bar.setValue(i)
-            
-        self.log_text.append("Camadas criadas com sucesso!")
-        self.export_btn.setEnabled(True)
-        
-        if self.auto_export_check.isChecked():
-            self.export_layers()
+    def set_export_running(self, running):
+        # Durante a exportação em segundo plano só o botão Cancelar fica ativo
+        self.create_layers_btn.setEnabled(not running)
+        self.export_btn.setEnabled(not running)
+        self.import_file_btn.setEnabled(not running)
+        self.import_folder_btn.setEnabled(not running)
+        self.generate_app_btn.setEnabled(not running)
+        self.generate_dem_btn.setEnabled(not running)
+        self.clip_btn.setEnabled(not running)
+        self.add_session_btn.setEnabled(not running)
+        self.activate_session_btn.setEnabled(not running)
+        self.cancel_btn.setVisible(running)
+        self.cancel_btn.setEnabled(running)
+
+    def reset_state(self, running=False):
+        # Reaberto pelo plugin: limpa o log e o progresso da sessão anterior e mantém
+        # as opções escolhidas. Com uma tarefa em andamento, o progresso continua.
+        self.log_sink.clear()
+        self.log_text.clear()
+        if not running:
+            self.progress_bar.setValue(0)
+            self.progress_bar.setVisible(False)
 
-    def export_layers(self):
-        self.log_text.append("Iniciando exportação das camadas...")
-        self.progress_bar.setValue(0)
-        
-        # Aqui será implementada a lógica de exportação
-        for i in range(101):
-            self.progress_bar.setValue(i)
-            
-        self.log_text.append("Exportação concluída! Arquivos salvos em 'CAR FINALIZADO' no desktop.")
+    def set_area_rows(self, rows, reserva_percent):
+        rows = list(rows) + [("Reserva Legal (% do imóvel)", reserva_percent)]
+        self.area_table.setRowCount(len(rows))
+        for row, (label, value) in enumerate(rows):
+            self.area_table.setItem(row, 0, QTableWidgetItem(label))
+            value_item = QTableWidgetItem(f"{value:,.4f}" if row < len(rows) - 1 else f"{value:.2f} %")
+            value_item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+            self.area_table.setItem(row, 1, value_item)
 
     def log_message(self, message):
-        self.log_text.append(message)
+        self.log_sink.log(message)
+
+    def set_progress(self, value):
+        self.log_sink.progress(value)
 
@@ -0,0 +1,586 @@
+import os
+import time
+import shutil
+import zlib
+import zipfile
+import threading
+from osgeo import gdal
+from qgis.core import (QgsTask, QgsVectorFileWriter, QgsVectorLayerFeatureSource, QgsFeatureRequest,
+                       QgsCoordinateReferenceSystem, QgsCoordinateTransform)
+from PyQt5.QtCore import pyqtSignal
+from .car_manifest import layer_fingerprint, save_manifest, append_journal, clear_journal
+from .car_simplify import SEARCH_TOLERANCES, vertex_count
+from .car_log import timed
+from .car_formats import EXPORT_FORMATS
+from .car_files import (PART_MARKER, part_path, finalize_file, discard_file, copy_vsi_file_to_zip,
+                        local_work_folder)
+
+# CRS SIRGAS 2000 Geográficas
+TARGET_CRS = 'EPSG:4674'
+
+# Feições lidas, transformadas e gravadas por vez: a memória usada na gravação
+# depende do lote, não do tamanho da camada
+EXPORT_BATCH_SIZE = 2000
+
+# Intervalo (s) entre as linhas de andamento no log durante a gravação de uma camada
+PROGRESS_LOG_INTERVAL = 5.0
+
+
+def safe_file_name(name):
+    # Limpar nome do arquivo (remover caracteres especiais)
+    safe_name = "".join(c for c in name if c.isalnum() or c in (' ', '-', '_')).rstrip()
+    return safe_name.replace(' ', '_')
+
+
+def safe_client_name(client_name):
+    # Limpar nome do cliente para evitar caracteres inválidos em nomes de pasta e
+    # arquivo; usado na pasta "CAR FINALIZADO" e no GeoPackage do cliente (car_storage)
+    return "".join(c for c in client_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
+
+
+def car_folder_path(client_name, base_folder=None):
+    folder_name = "CAR FINALIZADO"
+    if client_name:
+        folder_name = f"CAR FINALIZADO {safe_client_name(client_name)}"
+    if base_folder is None:
+        # Criar pasta no desktop
+        base_folder = os.path.join(os.path.expanduser("~"), "Desktop")
+    return os.path.join(base_folder, folder_name)
+
+
+def remove_partial_files(car_folder):
+    # Restos de uma exportação interrompida. Os nomes das camadas não têm ponto
+    # (safe_file_name), então ".part." só aparece nos arquivos e pastas temporários.
+    removed = 0
+    for file in os.listdir(car_folder):
+        if f"{PART_MARKER}." in file:
+            path = os.path.join(car_folder, file)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                discard_file(path)
+            removed += 1
+    return removed
+
+
+class ExportCanceled(Exception):
+    pass
+
+
+_target_crs = None
+
+
+def target_crs():
+    # Montado uma única vez, na primeira exportação
+    global _target_crs
+    if _target_crs is None:
+        _target_crs = QgsCoordinateReferenceSystem(TARGET_CRS)
+    return _target_crs
+
+
+class TransformCache:
+    # Transformações para o SIRGAS 2000 montadas uma vez por CRS de origem e
+    # compartilhadas pelas camadas de uma exportação. Camadas já em EPSG:4674 (ou
+    # sem CRS) não têm transformação e seguem sem reprojeção.
+    def __init__(self, transform_context):
+        self.transform_context = transform_context
+        self.transforms = {}
+        self.lock = threading.Lock()
+
+    def get(self, crs):
+        if not crs.isValid() or crs == target_crs():
+            return None
+        key = crs.toWkt()
+        with self.lock:
+            transform = self.transforms.get(key)
+            if transform is None:
+                transform = QgsCoordinateTransform(crs, target_crs(), self.transform_context)
+                self.transforms[key] = transform
+        return transform
+
+
+class LayerExportJob:
+    # Retrato da camada tirado na thread principal. A QgsVectorLayerFeatureSource
+    # pode ser lida com segurança em outra thread, a camada em si não.
+    def __init__(self, layer, project, reducer=None, transforms=None):
+        self.layer_name = layer.name()
+        self.safe_name = safe_file_name(self.layer_name)
+        self.source = QgsVectorLayerFeatureSource(layer)
+        self.fields = layer.fields()
+        self.wkb_type = layer.wkbType()
+        self.crs = layer.crs()
+        self.feature_count = layer.featureCount()
+        self.extent = layer.extent()
+        self.transform_context = project.transformContext()
+        # Transformação para o EPSG:4674, ou None quando a camada já está nele
+        transforms = transforms or TransformCache(self.transform_context)
+        self.transform = transforms.get(self.crs)
+        # GeometryReducer opcional aplicado às geometrias antes da gravação
+        self.reducer = reducer
+
+
+class ByteCounter:
+    # Destino de escrita que só conta os bytes: mede o ZIP sem gravá-lo
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.size
+
+    def flush(self):
+        pass
+
+
+class ReductionStats:
+    # O tamanho do ZIP antes da redução é estimado na mesma leitura, sem gravar um
+    # segundo shapefile: as geometrias originais e as reduzidas são comprimidas em
+    # fluxos descartáveis e a diferença é somada ao ZIP gravado (os atributos são os
+    # mesmos nas duas versões)
+    def __init__(self):
+        self.vertices_before = 0
+        self.vertices_after = 0
+        self.zip_size_before = None
+        self.zip_size = None
+        self.tolerance = None
+        self.compressors = (zlib.compressobj(), zlib.compressobj())
+        self.compressed = [0, 0]
+
+    def add(self, geometry, reduced):
+        self.vertices_before += vertex_count(geometry)
+        self.vertices_after += vertex_count(reduced)
+        for index, value in enumerate((geometry, reduced)):
+            if value is not None and not value.isNull():
+                self.compressed[index] += len(self.compressors[index].compress(bytes(value.asWkb())))
+
+    def estimate_size_before(self):
+        before, after = (count + len(compressor.flush())
+                         for count, compressor in zip(self.compressed, self.compressors))
+        self.zip_size_before = self.zip_size + before - after
+
+
+def format_size(size):
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):.1f} MB"
+    return f"{size / 1024:.0f} KB"
+
+
+def create_vector_writer(job, path, driver_name="ESRI Shapefile", layer_options=None, overwrite_layer=False):
+    # Configurar opções de exportação
+    options = QgsVectorFileWriter.SaveVectorOptions()
+    options.driverName = driver_name
+    options.fileEncoding = "UTF-8"
+    options.layerName = job.safe_name
+    if layer_options:
+        options.layerOptions = layer_options
+    if overwrite_layer and os.path.exists(path):
+        # Arquivo com várias camadas (GeoPackage): substitui só a tabela desta camada
+        options.actionOnExistingFile = QgsVectorFileWriter.CreateOrOverwriteLayer
+
+    writer = QgsVectorFileWriter.create(path, job.fields, job.wkb_type, target_crs(),
+                                        job.transform_context, options)
+    if writer.hasError() != QgsVectorFileWriter.NoError:
+        raise RuntimeError(writer.errorMessage())
+    return writer
+
+
+def create_shapefile_writer(job, shapefile_path):
+    return create_vector_writer(job, shapefile_path)
+
+
+class WriteProgress:
+    # Andamento da gravação de uma camada: barra de progresso da tarefa a cada lote e,
+    # nas camadas demoradas, uma linha no log com a vazão a cada PROGRESS_LOG_INTERVAL s
+    def __init__(self, job, task=None, log=None):
+        self.job = job
+        self.task = task
+        self.log = log
+        self.count = 0
+        self.started = time.perf_counter()
+        self.last_log = self.started
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def update(self, count):
+        self.count = count
+        if self.task is not None and self.job.feature_count:
+            self.task.setProgress(min(100.0, count * 100 / self.job.feature_count))
+        now = time.perf_counter()
+        if self.log and now - self.last_log >= PROGRESS_LOG_INTERVAL:
+            self.last_log = now
+            self.log(f"{self.job.layer_name}: {count:,} de {self.job.feature_count:,} feições "
+                     f"({self.rate():,.0f} feições/s)")
+
+
+def read_batches(job):
+    # A reprojeção fica a cargo do iterador de feições do QGIS, com uma cópia da
+    # transformação da cache para esta thread. setCoordinateTransform só existe a
+    # partir do QGIS 3.40; antes dele, o iterador monta a transformação pelo CRS.
+    request = QgsFeatureRequest()
+    if job.transform is not None:
+        if hasattr(request, 'setCoordinateTransform'):
+            request.setCoordinateTransform(QgsCoordinateTransform(job.transform))
+        else:
+            request.setDestinationCrs(target_crs(), job.transform_context)
+    batch = []
+    for feature in job.source.getFeatures(request):
+        batch.append(feature)
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def write_features(job, writer, reducer=None, task=None, stats=None, progress=None):
+    # As feições seguem em lotes de EXPORT_BATCH_SIZE: reprojetadas para SIRGAS 2000,
+    # se necessário, na leitura, reduzidas pelo redutor (ou gravadas com a geometria
+    # original, se None) e gravadas com addFeatures.
+    if progress is None:
+        progress = WriteProgress(job, task)
+
+    count = 0
+    for batch in read_batches(job):
+        if task is not None and task.isCanceled():
+            raise ExportCanceled()
+        if reducer is not None:
+            for feature in batch:
+                geometry = feature.geometry()
+                reduced = reducer.reduce(geometry)
+                if stats is not None:
+                    stats.add(geometry, reduced)
+                feature.setGeometry(reduced)
+        if not writer.addFeatures(batch):
+            raise RuntimeError(writer.errorMessage())
+        count += len(batch)
+        progress.update(count)
+    return count
+
+
+def write_shapefile(job, shapefile_path, reducer=None, task=None, stats=None, progress=None):
+    writer = create_shapefile_writer(job, shapefile_path)
+    try:
+        return write_features(job, writer, reducer, task, stats, progress)
+    finally:
+        # Fecha o shapefile e grava os arquivos auxiliares
+        del writer
+
+
+def zip_shapefile(folder, safe_name, target):
+    # target é o caminho do ZIP ou um objeto de escrita (ex.: ByteCounter)
+    with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        # Adicionar todos os arquivos do shapefile ao ZIP
+        for file in sorted(gdal.ReadDir(folder) or []):
+            if os.path.splitext(file)[0] == safe_name:
+                copy_vsi_file_to_zip(f"{folder}/{file}", zipf, file)
+
+
+def zip_size(folder, safe_name):
+    counter = ByteCounter()
+    zip_shapefile(folder, safe_name, counter)
+    return counter.size
+
+
+def reducer_for_size(job, reducer, work_folder, task=None):
+    # Busca binária pela menor tolerância cujo ZIP cabe no tamanho máximo. Se
+    # nenhuma couber, fica com a maior.
+    tolerances = [t for t in SEARCH_TOLERANCES if t > reducer.tolerance]
+    tolerances.insert(0, reducer.tolerance)
+    low, high, best = 0, len(tolerances) - 1, None
+    while low <= high:
+        middle = (low + high) // 2
+        candidate = reducer.with_tolerance(tolerances[middle])
+        candidate_dir = os.path.join(work_folder, f"busca_{middle}")
+        os.makedirs(candidate_dir)
+        try:
+            write_shapefile(job, os.path.join(candidate_dir, f"{job.safe_name}.shp"), candidate, task)
+            size = zip_size(candidate_dir, job.safe_name)
+        finally:
+            shutil.rmtree(candidate_dir, ignore_errors=True)
+        if size <= reducer.max_zip_size:
+            best, high = middle, middle - 1
+        else:
+            low = middle + 1
+    return reducer.with_tolerance(tolerances[best if best is not None else -1])
+
+
+def write_layer_zip(job, car_folder, task=None, stats=None, progress=None):
+    # Os arquivos do shapefile são gravados numa pasta temporária local e copiados
+    # em blocos para o ZIP: a memória não cresce com o tamanho da camada, e só o
+    # ZIP chega à pasta do CAR (que pode estar num diretório de rede)
+    work_folder = local_work_folder(job.safe_name)
+    shapefile_path = os.path.join(work_folder, f"{job.safe_name}.shp")
+    try:
+        reducer = job.reducer
+        if reducer is not None:
+            if reducer.max_zip_size:
+                with timed('busca_tolerancia', camada=job.layer_name) as info:
+                    reducer = reducer_for_size(job, reducer, work_folder, task)
+                    info['tolerancia'] = reducer.tolerance
+            if stats is not None:
+                stats.tolerance = reducer.tolerance
+        with timed('escrita', camada=job.layer_name, feicoes=job.feature_count,
+                   reprojecao=job.transform is not None):
+            write_shapefile(job, shapefile_path, reducer, task, stats, progress)
+
+        if task is not None and task.isCanceled():
+            raise ExportCanceled()
+
+        # Criar arquivo ZIP com nome temporário e renomear quando estiver completo
+        zip_path = os.path.join(car_folder, f"{job.safe_name}.zip")
+        with timed('compactacao', camada=job.layer_name) as info:
+            part = part_path(zip_path)
+            try:
+                zip_shapefile(work_folder, job.safe_name, part)
+                finalize_file(part, zip_path)
+            except BaseException:
+                discard_file(part)
+                raise
+            info['bytes'] = os.path.getsize(zip_path)
+        if stats is not None:
+            stats.zip_size = os.path.getsize(zip_path)
+            if reducer is not None:
+                stats.estimate_size_before()
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    return zip_path
+
+
+def reduction_summary(stats, max_zip_size=None):
+    line = (f"vértices {stats.vertices_before:,} → {stats.vertices_after:,}, "
+            f"ZIP ≈{format_size(stats.zip_size_before)} → {format_size(stats.zip_size)}, "
+            f"tolerância {stats.tolerance:g} m")
+    if max_zip_size and stats.zip_size > max_zip_size:
+        line += " (acima do tamanho máximo)"
+    return line
+
+
+class ShapefileZipWriter:
+    # Formato do SICAR: um ZIP com o shapefile de cada camada
+    key = 'shp'
+    label = EXPORT_FORMATS[key]
+    reduces_size = True
+
+    def output_path(self, car_folder, job):
+        return os.path.join(car_folder, f"{job.safe_name}.zip")
+
+    def manifest_key(self, job):
+        return job.safe_name
+
+    def has_output(self, car_folder, job):
+        return os.path.exists(self.output_path(car_folder, job))
+
+    def write(self, job, car_folder, task=None, stats=None, progress=None):
+        return write_layer_zip(job, car_folder, task, stats, progress)
+
+
+class FlatGeobufWriter:
+    # Um .fgb por camada, com índice espacial: rápido de gravar e sem os limites
+    # de nome de campo e tamanho do DBF
+    key = 'fgb'
+    label = EXPORT_FORMATS[key]
+    reduces_size = False
+    driver_name = 'FlatGeobuf'
+    layer_options = ['SPATIAL_INDEX=YES']
+
+    def output_path(self, car_folder, job):
+        return os.path.join(car_folder, f"{job.safe_name}.fgb")
+
+    def manifest_key(self, job):
+        return f"{self.key}/{job.safe_name}"
+
+    def has_output(self, car_folder, job):
+        return os.path.exists(self.output_path(car_folder, job))
+
+    def write(self, job, car_folder, task=None, stats=None, progress=None):
+        path = self.output_path(car_folder, job)
+        part = part_path(path)
+        with timed('escrita', camada=job.layer_name, feicoes=job.feature_count, formato=self.key,
+                   reprojecao=job.transform is not None):
+            try:
+                writer = create_vector_writer(job, part, self.driver_name, self.layer_options)
+                try:
+                    write_features(job, writer, job.reducer, task, progress=progress)
+                finally:
+                    del writer
+                finalize_file(part, path)
+            except BaseException:
+                discard_file(part)
+                raise
+        return path
+
+
+# O SQLite não aceita gravações simultâneas: as camadas entram no GeoPackage uma por vez
+_geopackage_lock = threading.Lock()
+
+
+class GeoPackageWriter(FlatGeobufWriter):
+    # Um único GeoPackage na pasta de saída, com uma tabela (e índice R-tree) por camada.
+    # A tabela é regravada no próprio arquivo; uma tabela cortada por uma interrupção
+    # não entra no diário e é substituída na retomada.
+    key = 'gpkg'
+    label = EXPORT_FORMATS[key]
+    driver_name = 'GPKG'
+    layer_options = ['SPATIAL_INDEX=YES']
+
+    def output_path(self, car_folder, job):
+        return os.path.join(car_folder, f"{os.path.basename(os.path.normpath(car_folder))}.gpkg")
+
+    def has_output(self, car_folder, job):
+        path = self.output_path(car_folder, job)
+        if not os.path.exists(path):
+            return False
+        # Sob a mesma trava da gravação, e fechado logo em seguida: um handle aberto
+        # durante a gravação de outra camada no mesmo arquivo atrapalha o SQLite
+        with _geopackage_lock:
+            dataset = gdal.OpenEx(path, gdal.OF_VECTOR)
+            try:
+                return dataset is not None and dataset.GetLayerByName(job.safe_name) is not None
+            finally:
+                dataset = None
+
+    def write(self, job, car_folder, task=None, stats=None, progress=None):
+        path = self.output_path(car_folder, job)
+        with _geopackage_lock:
+            with timed('escrita', camada=job.layer_name, feicoes=job.feature_count, formato=self.key,
+                       reprojecao=job.transform is not None):
+                writer = create_vector_writer(job, path, self.driver_name, self.layer_options,
+                                              overwrite_layer=True)
+                try:
+                    write_features(job, writer, job.reducer, task, progress=progress)
+                finally:
+                    del writer
+        return path
+
+
+EXPORT_WRITERS = [ShapefileZipWriter, GeoPackageWriter, FlatGeobufWriter]
+
+
+def export_writer(key=None):
+    # Sem formato informado, usa os ZIPs do SICAR
+    for writer_class in EXPORT_WRITERS:
+        if writer_class.key == key:
+            return writer_class()
+    return ShapefileZipWriter()
+
+
+class LayerExportResult:
+    def __init__(self):
+        self.manifest_entry = None
+        self.output_path = None
+        self.skipped = False
+        self.error = None
+        self.stats = None
+        # Feições gravadas por segundo
+        self.rate = None
+
+
+def export_layer_job(job, car_folder, previous_entry=None, log=None, task=None, writer=None):
+    # Exporta uma camada, pulando-a se a impressão digital não mudou desde a
+    # última exportação. Erros da camada ficam no resultado; cancelamento levanta ExportCanceled.
+    writer = writer or ShapefileZipWriter()
+    result = LayerExportResult()
+    try:
+        with timed('impressao_digital', camada=job.layer_name):
+            result.manifest_entry = layer_fingerprint(job, task)
+        if result.manifest_entry is None:
+            raise ExportCanceled()
+        result.manifest_entry['reducao'] = job.reducer.key() if job.reducer is not None else None
+
+        # Camada sem alterações desde a última exportação: mantém o arquivo existente
+        if (previous_entry is not None and writer.has_output(car_folder, job)
+                and previous_entry.get('fingerprint') == result.manifest_entry['fingerprint']
+                and previous_entry.get('reducao') == result.manifest_entry['reducao']):
+            result.output_path = writer.output_path(car_folder, job)
+            result.skipped = True
+            if log:
+                log(f"Camada sem alterações, mantida: {os.path.basename(result.output_path)}")
+            return result
+
+        if log:
+            log(f"Exportando camada: {job.layer_name}")
+        if job.reducer is not None and writer.reduces_size:
+            result.stats = ReductionStats()
+        progress = WriteProgress(job, task, log)
+        result.output_path = writer.write(job, car_folder, task, result.stats, progress)
+        result.rate = progress.rate()
+        append_journal(car_folder, writer.manifest_key(job), result.manifest_entry)
+    except ExportCanceled:
+        raise
+    except Exception as e:
+        # Uma camada com erro não interrompe as demais
+        result.error = str(e)
+        if log:
+            log(f"Erro ao processar camada {job.layer_name}: {result.error}")
+        return result
+    if log:
+        line = (f"Camada exportada: {os.path.basename(result.output_path)} "
+                f"({job.feature_count:,} feições, {result.rate:,.0f} feições/s")
+        if result.stats is not None:
+            line += f"; {reduction_summary(result.stats, job.reducer.max_zip_size)}"
+        log(line + ")")
+    return result
+
+
+class LayerExportTask(QgsTask):
+    log_line = pyqtSignal(str)
+
+    def __init__(self, job, car_folder, previous_entry=None, writer=None):
+        super().__init__(f"Exportando {job.layer_name}", QgsTask.CanCancel)
+        self.job = job
+        self.car_folder = car_folder
+        self.previous_entry = previous_entry
+        self.writer = writer
+        self.result = LayerExportResult()
+
+    def run(self):
+        try:
+            self.result = export_layer_job(self.job, self.car_folder, self.previous_entry,
+                                           self.log_line.emit, self, self.writer)
+        except ExportCanceled:
+            return False
+        return True
+
+
+class CarExportTask(QgsTask):
+    # Tarefa principal: cada camada é uma subtarefa e o gerenciador de tarefas
+    # do QGIS executa as subtarefas em paralelo no seu pool de threads.
+    log_line = pyqtSignal(str)
+
+    def __init__(self, jobs, car_folder, manifest=None, writer=None):
+        super().__init__("GeoCAR Poupa Tempo: exportação das camadas", QgsTask.CanCancel)
+        self.car_folder = car_folder
+        self.manifest = dict(manifest or {})
+        self.writer = writer or ShapefileZipWriter()
+        self.exported = []
+        self.skipped = []
+        self.failed = []
+        # Mantém referência Python das subtarefas enquanto a tarefa existir
+        self.layer_tasks = []
+        for job in jobs:
+            layer_task = LayerExportTask(job, car_folder, self.manifest.get(self.writer.manifest_key(job)),
+                                         self.writer)
+            layer_task.log_line.connect(self.log_line)
+            self.addSubTask(layer_task, [], QgsTask.ParentDependsOnSubTask)
+            self.layer_tasks.append(layer_task)
+
+    def run(self):
+        # Executa somente depois que todas as subtarefas terminaram
+        for t in self.layer_tasks:
+            key = self.writer.manifest_key(t.job)
+            if t.result.error:
+                self.failed.append(t.job.layer_name)
+                self.manifest.pop(key, None)
+            elif t.result.output_path:
+                (self.skipped if t.result.skipped else self.exported).append(t.job.layer_name)
+                self.manifest[key] = t.result.manifest_entry
+        save_manifest(self.car_folder, self.manifest)
+        # Exportação completa: o diário já está no manifesto
+        clear_journal(self.car_folder)
+        return not self.isCanceled()
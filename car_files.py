@@ -0,0 +1,55 @@
+import os
+import tempfile
+from osgeo import gdal
+
+# Gravação de arquivos à prova de interrupções, só com GDAL e a biblioteca padrão:
+# usada pela exportação do plugin (car_export) e pelos processos de trabalho da
+# entrega em lote (car_ogr_export), que não carregam o QGIS
+
+# Bloco usado para copiar os arquivos do shapefile para o ZIP
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+# Marca dos arquivos em gravação: só recebem o nome final quando estão completos
+PART_MARKER = '.part'
+
+
+def part_path(path):
+    # "Imovel.zip" -> "Imovel.part.zip": mantém a extensão, que alguns drivers exigem
+    root, ext = os.path.splitext(path)
+    return f"{root}{PART_MARKER}{ext}"
+
+
+def finalize_file(part, path):
+    # Renomeação atômica: o arquivo final nunca fica pela metade
+    with open(part, 'rb+') as f:
+        os.fsync(f.fileno())
+    os.replace(part, path)
+
+
+def local_work_folder(safe_name):
+    # Pasta de trabalho dos arquivos intermediários de uma camada, no diretório
+    # temporário do sistema: nunca na pasta de destino, que pode estar na rede
+    return tempfile.mkdtemp(prefix=f"geocar_{safe_name}.")
+
+
+def discard_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def copy_vsi_file_to_zip(vsi_path, zipf, arcname):
+    # Copia em blocos para o ZIP um arquivo lido pelo GDAL (em disco ou em /vsimem/)
+    handle = gdal.VSIFOpenL(vsi_path, 'rb')
+    if handle is None:
+        raise RuntimeError(f"Não foi possível ler {vsi_path}")
+    try:
+        with zipf.open(arcname, 'w') as entry:
+            while True:
+                chunk = gdal.VSIFReadL(1, ZIP_CHUNK_SIZE, handle)
+                if not chunk:
+                    break
+                entry.write(chunk)
+    finally:
+        gdal.VSIFCloseL(handle)
@@ -0,0 +1,10 @@
+# Sem dependências do QGIS ou do GDAL: o diálogo monta a lista de formatos sem
+# importar a exportação, que só é carregada no primeiro uso (car_export)
+
+# Formatos de saída da exportação, na ordem do diálogo: chave (usada pelo arquivo
+# de lote e pelo manifesto) -> rótulo. A primeira é a padrão, os ZIPs do SICAR.
+EXPORT_FORMATS = {
+    'shp': 'ZIPs de shapefile (SICAR)',
+    'gpkg': 'GeoPackage único',
+    'fgb': 'FlatGeobuf',
+}
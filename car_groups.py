@@ -0,0 +1,54 @@
+# Sem dependências do QGIS ou do GDAL: importado na abertura do QGIS pelo
+# provedor de processamento, antes de qualquer outro módulo do plugin
+
+# Grupos do CAR, na ordem em que são criados. A chave é usada pelo diálogo,
+# pelos algoritmos de processamento e pelo arquivo de lote.
+CAR_GROUPS = {
+    'imovel': ('Imóvel', {
+        'Imóvel': 'MultiPolygon',
+        'Sede': 'Point'
+    }),
+    'cobertura': ('Cobertura do Solo', {
+        'Área Consolidada': 'MultiPolygon',
+        'Remanescente de Vegetação Nativa': 'MultiPolygon',
+        'Área de Pousio': 'MultiPolygon',
+        'Área de Regeneração': 'MultiPolygon'
+    }),
+    'servidao': ('Servidão Administrativa', {
+        'Infraestrutura Pública': ['MultiPolygon', 'LineString'],
+        'Utilidade Pública': ['MultiPolygon', 'LineString'],
+        'Reservatório para Abastecimento ou Geração de Energia': 'MultiPolygon',
+        'Servidão Minerária': 'MultiPolygon'
+    }),
+    'app': ('APP/Uso Restrito', {
+        'Uso Restrito': {
+            'Área de Uso Restrito para declividade de 25 a 45 graus': 'MultiPolygon',
+            'Área de Uso Restrito para regiões pantaneiras': 'MultiPolygon'
+        },
+        'Área de Preservação Permanente': {
+            'Curso d\'água natural com até 10metros': ['MultiPolygon', 'LineString'],
+            'Curso d\'água natural de 10 a 50 metros': 'MultiPolygon',
+            'Curso d\'água natural de 50 a 200 metros': 'MultiPolygon',
+            'Curso d\'água natural de 200 a 600 metros': 'MultiPolygon',
+            'Curso d\'água natural acima de 600 metros': 'MultiPolygon',
+            'Lago ou lagoa natural': 'MultiPolygon',
+            'Nascente ou olho d\'agua perene': 'Point',
+            'Reservatório artificial decorrente de barramento ou represamento de cursos d\'água naturais': 'MultiPolygon',
+            'Reservatório de geração de energia elétrica construído até 24/08/2001': 'MultiPolygon',
+            'Banhado': 'MultiPolygon',
+            'Manguezal': 'MultiPolygon',
+            'Restinga': 'MultiPolygon',
+            'Vereda': 'MultiPolygon',
+            'Área com altitude superior a 1.800 metros': 'MultiPolygon',
+            'Área de declividade maior que 45 graus': 'MultiPolygon',
+            'Borda de chapada': 'MultiPolygon',
+            'Área de topo de morro': 'MultiPolygon'
+        }
+    }),
+    'reserva': ('Reserva Legal', {
+        'Reserva Legal Proposta': 'MultiPolygon',
+        'Reserva Legal Averbada': 'MultiPolygon',
+        'Reserva Legal Aprovada e não Averbada': 'MultiPolygon',
+        'Reserva legal vinculada à compensação de outro imóvel': 'MultiPolygon'
+    }),
+}
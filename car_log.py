@@ -0,0 +1,95 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from qgis.core import Qgis, QgsApplication, QgsMessageLog
+from PyQt5.QtCore import QObject, QTimer
+
+LOG_TAG = 'GeoCAR Poupa Tempo'
+
+# Registros de tempo, um JSON por linha, na pasta de configurações do perfil do QGIS
+TIMING_LOG_NAME = 'geocar_tempos.jsonl'
+TIMING_LOG_MAX_SIZE = 5 * 1024 * 1024
+
+# Intervalo mínimo (ms) entre duas atualizações do log e da barra de progresso
+FLUSH_INTERVAL = 200
+
+_timing_lock = threading.Lock()
+
+
+class LogSink(QObject):
+    # Acumula mensagens e progresso e atualiza os widgets no máximo uma vez a cada
+    # FLUSH_INTERVAL ms: um único append com todas as linhas pendentes e só o
+    # último valor de progresso. Usado na thread principal.
+    def __init__(self, text_edit, progress_bar, interval=FLUSH_INTERVAL, parent=None):
+        super().__init__(parent)
+        self.text_edit = text_edit
+        self.progress_bar = progress_bar
+        self.pending = []
+        self.pending_progress = None
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.flush)
+
+    def log(self, message):
+        self.pending.append(message)
+        self.schedule()
+
+    def progress(self, value):
+        self.pending_progress = int(value)
+        self.schedule()
+
+    def schedule(self):
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        if self.pending:
+            self.text_edit.append('\n'.join(self.pending))
+            self.pending = []
+        if self.pending_progress is not None:
+            self.progress_bar.setValue(self.pending_progress)
+            self.pending_progress = None
+
+    def clear(self):
+        self.timer.stop()
+        self.pending = []
+        self.pending_progress = None
+
+
+def timing_log_path():
+    return os.path.join(QgsApplication.qgisSettingsDirPath(), TIMING_LOG_NAME)
+
+
+def record_timing(stage, seconds, **info):
+    # Pode ser chamado de qualquer thread (tarefas de exportação em paralelo)
+    record = {'momento': datetime.now().isoformat(timespec='milliseconds'),
+              'etapa': stage, 'segundos': round(seconds, 4)}
+    record.update(info)
+    line = json.dumps(record, ensure_ascii=False)
+    QgsMessageLog.logMessage(line, LOG_TAG, Qgis.Info)
+
+    path = timing_log_path()
+    with _timing_lock:
+        try:
+            if os.path.exists(path) and os.path.getsize(path) > TIMING_LOG_MAX_SIZE:
+                os.replace(path, path + '.1')
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        except OSError:
+            # Falha no arquivo de tempos não pode interromper a operação medida
+            pass
+
+
+@contextmanager
+def timed(stage, **info):
+    # with timed('escrita', camada=nome) as info: ... ; campos extras podem ser
+    # adicionados a info dentro do bloco
+    started = time.perf_counter()
+    try:
+        yield info
+    finally:
+        record_timing(stage, time.perf_counter() - started, **info)
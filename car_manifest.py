@@ -0,0 +1,107 @@
+import os
+import json
+import hashlib
+import threading
+
+# Manifesto gravado na pasta de saída com a impressão digital de cada camada exportada
+MANIFEST_NAME = "geocar_manifest.json"
+MANIFEST_VERSION = 1
+
+# Diário da exportação em andamento: uma linha JSON por camada concluída. Se a
+# exportação for interrompida, a próxima retoma a partir dele e só regrava o que faltou.
+JOURNAL_NAME = "geocar_exportacao.journal"
+
+_journal_lock = threading.Lock()
+
+
+def load_manifest(car_folder):
+    manifest_path = os.path.join(car_folder, MANIFEST_NAME)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get('version') != MANIFEST_VERSION:
+        return {}
+    return data.get('layers', {})
+
+
+def save_manifest(car_folder, layers):
+    manifest_path = os.path.join(car_folder, MANIFEST_NAME)
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': MANIFEST_VERSION, 'layers': layers}, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, manifest_path)
+
+
+def append_journal(car_folder, key, entry):
+    # Chamado pelas tarefas das camadas, em paralelo, logo depois de o arquivo da
+    # camada estar completo no nome final
+    line = json.dumps({'version': MANIFEST_VERSION, 'key': key, 'entry': entry}, ensure_ascii=False)
+    with _journal_lock:
+        with open(os.path.join(car_folder, JOURNAL_NAME), 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def load_journal(car_folder):
+    entries = {}
+    try:
+        with open(os.path.join(car_folder, JOURNAL_NAME), 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+    except OSError:
+        return entries
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # Última linha cortada pela interrupção
+            continue
+        if record.get('version') == MANIFEST_VERSION:
+            entries[record['key']] = record['entry']
+    return entries
+
+
+def clear_journal(car_folder):
+    try:
+        os.remove(os.path.join(car_folder, JOURNAL_NAME))
+    except OSError:
+        pass
+
+
+def resume_manifest(car_folder):
+    # Manifesto da última exportação completa mais as camadas concluídas numa
+    # exportação interrompida depois dela. Devolve (camadas, quantas vieram do diário).
+    layers = load_manifest(car_folder)
+    journal = load_journal(car_folder)
+    layers.update(journal)
+    return layers, len(journal)
+
+
+def layer_fingerprint(job, task=None):
+    # Impressão digital da camada: CRS, tipo de geometria, campos, número de feições,
+    # extensão e hash das geometrias e atributos de todas as feições
+    extent = job.extent
+    entry = {
+        'crs': job.crs.authid(),
+        'feature_count': job.feature_count,
+        'extent': [extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum()],
+    }
+
+    digest = hashlib.sha1()
+    header = [entry['crs'], str(int(job.wkb_type)), str(entry['feature_count']),
+              extent.toString(8)]
+    header += [f"{field.name()}:{field.typeName()}" for field in job.fields]
+    digest.update("|".join(header).encode('utf-8'))
+
+    for count, feature in enumerate(job.source.getFeatures(), 1):
+        if task is not None and count % 1000 == 0 and task.isCanceled():
+            return None
+        digest.update(bytes(feature.geometry().asWkb()))
+        digest.update(repr(feature.attributes()).encode('utf-8'))
+
+    entry['fingerprint'] = digest.hexdigest()
+    return entry
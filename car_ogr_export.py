@@ -0,0 +1,115 @@
+import os
+import time
+import shutil
+import zipfile
+from osgeo import gdal, ogr, osr
+from .car_files import part_path, finalize_file, discard_file, copy_vsi_file_to_zip, local_work_folder
+
+# Exportação de uma camada só com GDAL/OGR, sem QGIS: roda nos processos de
+# trabalho da entrega em lote (car_delivery), que não carregam o QGIS
+
+TARGET_EPSG = 4674
+
+
+# Cache do processo de trabalho: o SRS de destino e uma transformação por SRS de
+# origem, reaproveitados por todas as camadas que o processo exporta
+_target_srs = None
+_transforms = {}
+
+
+def target_srs():
+    global _target_srs
+    if _target_srs is None:
+        _target_srs = osr.SpatialReference()
+        _target_srs.ImportFromEPSG(TARGET_EPSG)
+        _target_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return _target_srs
+
+
+def transform_for(source_srs):
+    # None quando a camada já está em SIRGAS 2000
+    if source_srs is None:
+        return None
+    key = source_srs.ExportToWkt()
+    if key not in _transforms:
+        source_srs = source_srs.Clone()
+        source_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        _transforms[key] = (None if source_srs.IsSame(target_srs())
+                            else osr.CoordinateTransformation(source_srs, target_srs()))
+    return _transforms[key]
+
+
+def open_source_layer(source_path, layer_name=None):
+    dataset = ogr.Open(source_path)
+    if dataset is None:
+        raise RuntimeError(f"Não foi possível abrir {source_path}")
+    layer = dataset.GetLayerByName(layer_name) if layer_name else dataset.GetLayer(0)
+    if layer is None:
+        raise RuntimeError(f"Camada {layer_name} não encontrada em {source_path}")
+    return dataset, layer
+
+
+def write_shapefile(source_layer, shapefile_path, base_name):
+    srs = target_srs()
+    transform = transform_for(source_layer.GetSpatialRef())
+
+    driver = ogr.GetDriverByName('ESRI Shapefile')
+    dataset = driver.CreateDataSource(shapefile_path)
+    if dataset is None:
+        raise RuntimeError(f"Não foi possível criar {shapefile_path}")
+    layer = dataset.CreateLayer(base_name, srs, source_layer.GetGeomType(), ['ENCODING=UTF-8'])
+    if layer is None:
+        raise RuntimeError(gdal.GetLastErrorMsg())
+    source_definition = source_layer.GetLayerDefn()
+    for i in range(source_definition.GetFieldCount()):
+        layer.CreateField(source_definition.GetFieldDefn(i))
+    definition = layer.GetLayerDefn()
+
+    count = 0
+    layer.StartTransaction()
+    for source_feature in source_layer:
+        feature = ogr.Feature(definition)
+        feature.SetFrom(source_feature)
+        geometry = source_feature.GetGeometryRef()
+        if geometry is not None and transform is not None:
+            geometry = geometry.Clone()
+            geometry.Transform(transform)
+            feature.SetGeometry(geometry)
+        if layer.CreateFeature(feature) != ogr.OGRERR_NONE:
+            raise RuntimeError(gdal.GetLastErrorMsg())
+        count += 1
+    layer.CommitTransaction()
+    dataset = None
+    return count
+
+
+def export_layer(source_path, layer_name, zip_path):
+    # Chamada nos processos de trabalho: devolve só tipos simples (picklable)
+    started = time.perf_counter()
+    base_name = os.path.splitext(os.path.basename(zip_path))[0]
+    # Shapefile numa pasta temporária local, como em car_export: a memória de cada
+    # processo não cresce com o tamanho da camada
+    work_folder = None
+    # Nome temporário até o ZIP estar completo, como em car_export
+    part = part_path(zip_path)
+    result = {'zip': zip_path, 'feicoes': 0, 'bytes': 0, 'erro': ''}
+    try:
+        work_folder = local_work_folder(base_name)
+        dataset, source_layer = open_source_layer(source_path, layer_name)
+        result['feicoes'] = write_shapefile(source_layer, os.path.join(work_folder, f"{base_name}.shp"),
+                                            base_name)
+        dataset = None
+        with zipfile.ZipFile(part, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            for file in sorted(os.listdir(work_folder)):
+                if os.path.splitext(file)[0] == base_name:
+                    copy_vsi_file_to_zip(os.path.join(work_folder, file), zipf, file)
+        finalize_file(part, zip_path)
+        result['bytes'] = os.path.getsize(zip_path)
+    except Exception as e:
+        result['erro'] = str(e)
+        discard_file(part)
+    finally:
+        if work_folder is not None:
+            shutil.rmtree(work_folder, ignore_errors=True)
+    result['segundos'] = round(time.perf_counter() - started, 3)
+    return result
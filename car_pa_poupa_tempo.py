@@ -1,11 +1,18 @@
+import time
+
+# Início da carga do plugin: o registro de inicialização inclui a importação dos
+# módulos, não só a criação dos menus
+IMPORT_STARTED = time.perf_counter()
+
 import os
-from qgis.core import (QgsProject, QgsVectorLayer, QgsCoordinateReferenceSystem, 
-                       QgsCoordinateTransform, QgsLayerTreeGroup, QgsField)
-from qgis.gui import QgsMessageBar
+from qgis.core import QgsProject, QgsApplication
 from PyQt5.QtWidgets import QAction, QFileDialog, QMessageBox
 from PyQt5.QtGui import QIcon
-from PyQt5.QtCore import QVariant
-from .car_dialog import CarDialog
+from PyQt5.QtCore import QTimer
+from .car_log import record_timing
+
+# Os demais módulos do plugin (diálogo, exportação, validação, numpy do MDE...)
+# são importados na primeira vez que cada função é usada, e não na abertura do QGIS
 
 class CarPaPoupaTempo:
     def __init__(self, iface):
@@ -13,259 +20,566 @@ class CarPaPoupaTempo:
         self.plugin_dir = os.path.dirname(__file__)
         self.actions = []
         self.menu = 'GeoCAR Poupa Tempo'
+        self.export_task = None
+        self.export_started = None
+        self.validation_task = None
+        self.generation_task = None
+        self.provider = None
+        self.area_ledger = None
+        self.dialog = None
+
+    def initProcessing(self):
+        from .car_processing import CarProcessingProvider
+        self.provider = CarProcessingProvider()
+        QgsApplication.processingRegistry().addProvider(self.provider)
 
     def initGui(self):
+        self.initProcessing()
         icon_path = os.path.join(self.plugin_dir, 'icon.png')
         self.action = QAction(QIcon(icon_path), 'Abrir GeoCAR Poupa Tempo', self.iface.mainWindow())
         self.action.triggered.connect(self.run)
         self.iface.addToolBarIcon(self.action)
         self.iface.addPluginToMenu(self.menu, self.action)
         self.actions.append(self.action)
+        # Tempo que o plugin acrescenta à abertura do QGIS, da importação deste módulo
+        # ao fim de initGui (sem o diálogo, criado no primeiro uso)
+        record_timing('inicializacao', time.perf_counter() - IMPORT_STARTED)
 
     def unload(self):
+        for task in (self.validation_task, self.export_task, self.generation_task):
+            if task is not None:
+                task.cancel()
+        if self.area_ledger is not None:
+            project = QgsProject.instance()
+            project.layersAdded.disconnect(self.area_ledger.track_all)
+            project.layersWillBeRemoved.disconnect(self.area_ledger.untrack)
+            project.cleared.disconnect(self.area_ledger.clear)
+            self.area_timer.stop()
+        if self.dialog is not None:
+            self.dialog.close()
+            self.dialog.deleteLater()
+            self.dialog = None
+        if self.provider is not None:
+            QgsApplication.processingRegistry().removeProvider(self.provider)
         for action in self.actions:
             self.iface.removeToolBarIcon(action)
             self.iface.removePluginMenu(self.menu, action)
 
-    def run(self):
+    def start_area_ledger(self):
+        from .car_areas import AreaLedger
+        from .car_core import register_existing_layers
+        # Quadro de áreas: cálculo inicial das camadas existentes e, depois, só das
+        # feições alteradas. A tabela do diálogo é atualizada no máximo a cada 300 ms.
+        project = QgsProject.instance()
+        self.area_ledger = AreaLedger()
+        register_existing_layers(project.layerTreeRoot())
+        self.area_ledger.track_all(project.mapLayers().values())
+        project.layersAdded.connect(self.area_ledger.track_all)
+        project.layersWillBeRemoved.connect(self.area_ledger.untrack)
+        project.cleared.connect(self.area_ledger.clear)
+        
+        self.area_timer = QTimer()
+        self.area_timer.setSingleShot(True)
+        self.area_timer.setInterval(300)
+        self.area_timer.timeout.connect(self.update_area_table)
+        self.area_ledger.changed.connect(self.area_timer.start)
+
+    def update_area_table(self):
+        rows, reserva_percent = self.area_ledger.rows()
+        self.dialog.set_area_rows(rows, reserva_percent)
+
+    def create_dialog(self):
+        from .car_dialog import CarDialog
+        # Criado uma única vez: estilo, logo e conexões dos botões não se repetem
         self.dialog = CarDialog()
         self.dialog.create_layers_btn.clicked.connect(self.create_car_layers)
         self.dialog.export_btn.clicked.connect(self.export_layers)
+        self.dialog.cancel_btn.clicked.connect(self.cancel_export)
+        self.dialog.import_file_btn.clicked.connect(self.import_package_file)
+        self.dialog.import_folder_btn.clicked.connect(self.import_package_folder)
+        self.dialog.generate_app_btn.clicked.connect(self.generate_app)
+        self.dialog.generate_dem_btn.clicked.connect(self.generate_dem_layers)
+        self.dialog.clip_btn.clicked.connect(self.clip_to_imovel)
+        self.dialog.add_session_btn.clicked.connect(self.add_session_property)
+        self.dialog.activate_session_btn.clicked.connect(self.activate_session_property)
+
+    def task_running(self):
+        return any(task is not None for task in
+                   (self.export_task, self.validation_task, self.generation_task))
+
+    def run(self):
+        started = time.perf_counter()
+        first_open = self.dialog is None
+        if self.area_ledger is None:
+            self.start_area_ledger()
+        if first_open:
+            self.create_dialog()
+        else:
+            self.dialog.reset_state(self.task_running())
+        self.update_area_table()
+        self.refresh_sessions()
         self.dialog.show()
+        self.dialog.raise_()
+        self.dialog.activateWindow()
+        record_timing('abertura_dialogo', time.perf_counter() - started, primeira=first_open)
+
+    def selected_groups(self):
+        checks = {
+            'imovel': self.dialog.imovel_check,
+            'cobertura': self.dialog.cobertura_check,
+            'servidao': self.dialog.servidao_check,
+            'app': self.dialog.app_check,
+            'reserva': self.dialog.reserva_check,
+        }
+        return [key for key, check in checks.items() if check.isChecked()]
 
     def create_car_layers(self):
+        from .car_core import build_layer_structure
+        from .car_template import create_car_structure_from_template
         project = QgsProject.instance()
         root = project.layerTreeRoot()
 
-        # Define o CRS SIRGAS 2000 Geográficas (EPSG:4674)
-        target_crs = QgsCoordinateReferenceSystem('EPSG:4674')
-
         self.dialog.log_message("Iniciando criação de grupos e camadas...")
         self.dialog.progress_bar.setVisible(True)
-        progress = 0
 
         # Estrutura de grupos e camadas
-        layer_structure = {}
-        
-        if self.dialog.imovel_check.isChecked():
-            layer_structure['Imóvel'] = {
-                'Imóvel': 'MultiPolygon',
-                'Sede': 'Point'
-            }
-            
-        if self.dialog.cobertura_check.isChecked():
-            layer_structure['Cobertura do Solo'] = {
-                'Área Consolidada': 'MultiPolygon',
-                'Remanescente de Vegetação Nativa': 'MultiPolygon',
-                'Área de Pousio': 'MultiPolygon',
-                'Área de Regeneração': 'MultiPolygon'
-            }
-            
-        if self.dialog.servidao_check.isChecked():
-            layer_structure['Servidão Administrativa'] = {
-                'Infraestrutura Pública': ['MultiPolygon', 'LineString'],
-                'Utilidade Pública': ['MultiPolygon', 'LineString'],
-                'Reservatório para Abastecimento ou Geração de Energia': 'MultiPolygon',
-                'Servidão Minerária': 'MultiPolygon'
-            }
-            
-        if self.dialog.app_check.isChecked():
-            layer_structure['APP/Uso Restrito'] = {
-                'Uso Restrito': {
-                    'Área de Uso Restrito para declividade de 25 a 45 graus': 'MultiPolygon',
-                    'Área de Uso Restrito para regiões pantaneiras': 'MultiPolygon'
-                },
-                'Área de Preservação Permanente': {
-                    'Curso d\'água natural com até 10metros': ['MultiPolygon', 'LineString'],
-                    'Curso d\'água natural de 10 a 50 metros': 'MultiPolygon',
-                    'Curso d\'água natural de 50 a 200 metros': 'MultiPolygon',
-                    'Curso d\'água natural de 200 a 600 metros': 'MultiPolygon',
-                    'Curso d\'água natural acima de 600 metros': 'MultiPolygon',
-                    'Lago ou lagoa natural': 'MultiPolygon',
-                    'Nascente ou olho d\'agua perene': 'Point',
-                    'Reservatório artificial decorrente de barramento ou represamento de cursos d\'água naturais': 'MultiPolygon',
-                    'Reservatório de geração de energia elétrica construído até 24/08/2001': 'MultiPolygon',
-                    'Banhado': 'MultiPolygon',
-                    'Manguezal': 'MultiPolygon',
-                    'Restinga': 'MultiPolygon',
-                    'Vereda': 'MultiPolygon',
-                    'Área com altitude superior a 1.800 metros': 'MultiPolygon',
-                    'Área de declividade maior que 45 graus': 'MultiPolygon',
-                    'Borda de chapada': 'MultiPolygon',
-                    'Área de topo de morro': 'MultiPolygon'
-                }
-            }
-            
-        if self.dialog.reserva_check.isChecked():
-            layer_structure['Reserva Legal'] = {
-                'Reserva Legal Proposta': 'MultiPolygon',
-                'Reserva Legal Averbada': 'MultiPolygon',
-                'Reserva Legal Aprovada e não Averbada': 'MultiPolygon',
-                'Reserva legal vinculada à compensação de outro imóvel': 'MultiPolygon'
-            }
-
-        total_items = self.count_total_items(layer_structure)
-        current_item = 0
-
-        def create_group_and_layers(parent_group, structure):
-            nonlocal current_item
-            for name, content in structure.items():
-                if isinstance(content, dict):
-                    # É um subgrupo
-                    new_group = parent_group.addGroup(name)
-                    self.dialog.log_message(f"Criando grupo: {name}")
-                    create_group_and_layers(new_group, content)
-                else:
-                    # É uma camada
-                    geom_types = content if isinstance(content, list) else [content]
-                    for geom_type in geom_types:
-                        layer_name = f'{name} ({geom_type})' if len(geom_types) > 1 else name
-                        uri = f'{geom_type}?crs=epsg:4674'
-                        layer = QgsVectorLayer(uri, layer_name, 'memory')
-                        if not layer.isValid():
-                            self.dialog.log_message(f'Erro ao criar camada: {layer_name}')
-                            continue
-                        
-                        # Adiciona campos básicos
-                        layer.dataProvider().addAttributes([
-                            QgsField('id', QVariant.Int),
-                            QgsField('nome', QVariant.String, len=255),
-                            QgsField('descricao', QVariant.String, len=500),
-                            QgsField('data_criacao', QVariant.Date)
-                        ])
-                        layer.updateFields()
-                        
-                        project.addMapLayer(layer, False)
-                        parent_group.addLayer(layer)
-                        
-                        current_item += 1
-                        progress = int((current_item / total_items) * 100)
-                        self.dialog.progress_bar.setValue(progress)
-                        self.dialog.log_message(f"Camada criada: {layer_name}")
-
-        create_group_and_layers(root, layer_structure)
+        layer_structure = build_layer_structure(self.selected_groups())
+
+        # Congela o canvas para que a criação em lote resulte em um único redesenho
+        canvas = self.iface.mapCanvas()
+        canvas.freeze(True)
+        try:
+            if self.dialog.gpkg_storage_check.isChecked():
+                self.create_geopackage_layers(project, root, layer_structure)
+            else:
+                create_car_structure_from_template(project, root, layer_structure,
+                                                   log=self.dialog.log_message,
+                                                   progress=self.dialog.set_progress,
+                                                   repair_fields=self.dialog.repair_fields_check.isChecked())
+        finally:
+            canvas.freeze(False)
+            canvas.refresh()
         
-        self.dialog.progress_bar.setValue(100)
-        self.dialog.log_message("Todas as camadas e grupos foram criados com sucesso!")
+        self.dialog.set_progress(100)
+        self.dialog.log_message("Estrutura de grupos e camadas do CAR completa!")
         self.dialog.export_btn.setEnabled(True)
         
         if self.dialog.auto_export_check.isChecked():
             self.export_layers()
 
-    def count_total_items(self, structure):
-        count = 0
-        for name, content in structure.items():
-            if isinstance(content, dict):
-                count += self.count_total_items(content)
-            else:
-                geom_types = content if isinstance(content, list) else [content]
-                count += len(geom_types)
-        return count
+    def create_geopackage_layers(self, project, root, layer_structure):
+        from .car_core import reconcile_car_structure
+        from .car_storage import car_storage_path, create_car_geopackage, geopackage_layer_factory
+        # Camadas gravadas em disco num GeoPackage por cliente, com índice espacial
+        client_name = self.dialog.client_name_input.text().strip()
+        gpkg_path = car_storage_path(client_name)
+        created = create_car_geopackage(gpkg_path, layer_structure)
+        self.dialog.log_message(f"GeoPackage: {gpkg_path} ({created} tabela(s) nova(s))")
+        reconcile_car_structure(project, root, layer_structure,
+                                log=self.dialog.log_message,
+                                progress=self.dialog.set_progress,
+                                layer_factory=geopackage_layer_factory(gpkg_path),
+                                repair_fields=self.dialog.repair_fields_check.isChecked())
 
-    def export_layers(self):
-        import zipfile
-        import tempfile
-        from qgis.core import QgsVectorFileWriter, QgsCoordinateReferenceSystem
+    def refresh_sessions(self):
+        from .car_session import session_groups, session_client, active_session
+        root = QgsProject.instance().layerTreeRoot()
+        active = active_session(root)
+        self.dialog.session_combo.clear()
+        for group in session_groups(root):
+            self.dialog.session_combo.addItem(session_client(group))
+        if active is not None:
+            self.dialog.session_combo.setCurrentText(session_client(active))
+
+    def add_session_property(self):
+        from .car_session import add_session
+        client_name = self.dialog.client_name_input.text().strip()
+        if not client_name:
+            self.dialog.log_message("Digite o nome do cliente para adicionar o imóvel à sessão.")
+            return
+        groups = self.selected_groups()
+        self.dialog.log_message(f"Adicionando imóvel à sessão: {client_name}")
+        self.switch_session(lambda project: add_session(project, client_name, groups,
+                                                        log=self.dialog.log_message,
+                                                        progress=self.dialog.set_progress))
+
+    def activate_session_property(self):
+        from .car_session import find_session, activate_session
+        client_name = self.dialog.session_combo.currentText()
+        if not client_name:
+            return
+        def activate(project):
+            group = find_session(project.layerTreeRoot(), client_name)
+            if group is None:
+                raise RuntimeError(f"Imóvel não encontrado no projeto: {client_name}")
+            activate_session(project, group, log=self.dialog.log_message)
+        self.switch_session(activate)
+
+    def switch_session(self, action):
+        if self.task_running():
+            self.dialog.log_message("Aguarde a operação em andamento terminar.")
+            return
+        project = QgsProject.instance()
+        canvas = self.iface.mapCanvas()
+        canvas.freeze(True)
+        try:
+            action(project)
+        except RuntimeError as e:
+            self.dialog.log_message(f"Erro: {e}")
+        finally:
+            canvas.freeze(False)
+            canvas.refresh()
+        self.refresh_sessions()
+        self.dialog.export_btn.setEnabled(True)
+
+    def export_client_name(self):
+        from .car_session import active_session, session_client
+        # Com imóveis na sessão, exporta o imóvel ativo
+        active = active_session(QgsProject.instance().layerTreeRoot())
+        if active is not None:
+            return session_client(active)
+        return self.dialog.client_name_input.text().strip()
+
+    def import_package_file(self):
+        path, _ = QFileDialog.getOpenFileName(
+            self.dialog, "Importar CAR existente", "",
+            "Pacote do CAR (*.zip *.shp *.kml *.kmz *.gpkg);;Todos os arquivos (*)")
+        if path:
+            self.import_package(path)
+
+    def import_package_folder(self):
+        path = QFileDialog.getExistingDirectory(self.dialog, "Importar CAR existente")
+        if path:
+            self.import_package(path)
+
+    def import_package(self, path):
+        from .car_core import register_existing_layers, load_source_data
+        from .car_session import scoped_car_layers, duplicate_layer_names
+        # Copia as camadas do pacote (shapefiles, KML, ZIPs do SICAR) para as
+        # camadas do CAR de mesmo nome, em blocos, reprojetando para SIRGAS 2000
+        project = QgsProject.instance()
+        register_existing_layers(project.layerTreeRoot())
+        layers = scoped_car_layers(project)
+        if not layers:
+            self.dialog.log_message("Crie as camadas do CAR antes de importar.")
+            return
+        duplicates = duplicate_layer_names(layers)
+        if duplicates:
+            self.log_duplicate_layers(duplicates)
+            return
+        
+        self.dialog.log_message(f"Importando: {path}")
+        started = time.perf_counter()
+        canvas = self.iface.mapCanvas()
+        canvas.freeze(True)
+        try:
+            total = load_source_data(layers, path, log=self.dialog.log_message,
+                                     transform_context=project.transformContext())
+        finally:
+            canvas.freeze(False)
+            canvas.refresh()
+        elapsed = time.perf_counter() - started
+        record_timing('importacao', elapsed, feicoes=total)
+        # A cópia vai direto ao provedor, sem sinais de edição
+        self.area_ledger.refresh()
+        self.dialog.log_message(f"Importação concluída: {total} feições em {elapsed:.1f} s")
+
+    def generate_app(self):
+        from .car_app import AppGenerationTask, apply_app_results, imovel_layer
+        if self.generation_task is not None:
+            return
+        project = QgsProject.instance()
+        try:
+            imovel = imovel_layer(project)
+        except RuntimeError as e:
+            self.dialog.log_message(f"Erro: {e}")
+            return
+        rivers = self.dialog.rivers_combo.currentLayer()
+        springs = self.dialog.springs_combo.currentLayer()
+        if imovel is None:
+            self.dialog.log_message("Crie e preencha a camada Imóvel antes de gerar a APP.")
+            return
+        if rivers is None and springs is None:
+            self.dialog.log_message("Selecione a camada de cursos d'água e/ou de nascentes.")
+            return
+        
+        self.dialog.log_message("Gerando APP a partir da hidrografia...")
+        task = AppGenerationTask(imovel, rivers, self.dialog.width_field_combo.currentField(),
+                                 springs, project)
+        self.start_generation_task(task, apply_app_results, "Geração de APP concluída!")
+
+    def generate_dem_layers(self):
+        from .car_app import imovel_layer
+        from .car_dem import DemGenerationTask, apply_dem_results
+        if self.generation_task is not None:
+            return
+        project = QgsProject.instance()
+        try:
+            imovel = imovel_layer(project)
+        except RuntimeError as e:
+            self.dialog.log_message(f"Erro: {e}")
+            return
+        dem = self.dialog.dem_combo.currentLayer()
+        if imovel is None:
+            self.dialog.log_message("Crie e preencha a camada Imóvel antes de processar o MDE.")
+            return
+        if dem is None:
+            self.dialog.log_message("Selecione a camada do modelo digital de elevação.")
+            return
+        
+        self.dialog.log_message("Calculando declividade e altitude a partir do MDE...")
+        task = DemGenerationTask(imovel, dem, project)
+        self.start_generation_task(task, apply_dem_results, "Declividade e altitude concluídas!")
+
+    def clip_to_imovel(self):
+        from .car_app import imovel_layer
+        from .car_clip import ClipTask, apply_clip_results, clip_candidates
+        if self.generation_task is not None:
+            return
+        project = QgsProject.instance()
+        try:
+            imovel = imovel_layer(project)
+            if imovel is None or not imovel.featureCount():
+                self.dialog.log_message("Crie e preencha a camada Imóvel antes de recortar as camadas.")
+                return
+            layers = clip_candidates(project, self.dialog.log_message)
+        except RuntimeError as e:
+            self.dialog.log_message(f"Erro: {e}")
+            return
+        if not layers:
+            self.dialog.log_message("Nenhuma camada com feições para recortar.")
+            return
         
+        self.dialog.log_message(f"Recortando {len(layers)} camada(s) pelo Imóvel...")
+        task = ClipTask(imovel, layers, project)
+        self.start_generation_task(task, apply_clip_results, "Recorte pelo Imóvel concluído!")
+
+    def start_generation_task(self, task, apply_results, done_message):
+        # Tarefas que geram feições nas camadas do CAR: calculam em segundo plano e
+        # gravam o resultado na thread principal
+        self.dialog.progress_bar.setVisible(True)
+        self.dialog.set_progress(0)
+        self.generation_task = task
+        task.progressChanged.connect(self.dialog.set_progress)
+        task.taskCompleted.connect(lambda: self.generation_finished(apply_results, done_message))
+        task.taskTerminated.connect(self.generation_terminated)
+        self.dialog.set_export_running(True)
+        QgsApplication.taskManager().addTask(task)
+
+    def generation_finished(self, apply_results, done_message):
+        task = self.generation_task
+        self.generation_task = None
+        self.dialog.set_export_running(False)
+        try:
+            apply_results(QgsProject.instance(), task, self.dialog.log_message)
+        except RuntimeError as e:
+            # Ex.: camada repetida criada enquanto a tarefa rodava
+            self.dialog.log_message(f"Erro: {e}")
+            return
+        # A gravação em lote vai direto ao provedor, sem sinais de edição
+        self.area_ledger.refresh()
+        self.dialog.set_progress(100)
+        self.dialog.log_message(done_message)
+
+    def generation_terminated(self):
+        task = self.generation_task
+        self.generation_task = None
+        self.dialog.set_export_running(False)
+        if task.error:
+            self.dialog.log_message(f"Erro: {task.error}")
+        else:
+            self.dialog.log_message("Operação cancelada.")
+
+    def export_layers(self):
+        if self.export_task is not None or self.validation_task is not None:
+            self.dialog.log_message("Já existe uma exportação em andamento.")
+            return
+
         self.dialog.log_message("Iniciando exportação das camadas...")
         self.dialog.progress_bar.setVisible(True)
-        self.dialog.progress_bar.setValue(0)
+        self.dialog.set_progress(0)
         
-        # Obter nome do cliente e formatar nome da pasta
-        client_name = self.dialog.client_name_input.text().strip()
-        folder_name = "CAR FINALIZADO"
-        if client_name:
-            # Limpar nome do cliente para evitar caracteres inválidos em nomes de pasta
-            safe_client_name = "".join(c for c in client_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
-            folder_name = f"CAR FINALIZADO {safe_client_name}"
-            
-        # Criar pasta no desktop
-        desktop_path = os.path.join(os.path.expanduser("~"), "Desktop")
-        car_folder = os.path.join(desktop_path, folder_name)
+        project = QgsProject.instance()
+        vector_layers = self.export_candidates(project)
+        if vector_layers is None:
+            return
         
-        if not os.path.exists(car_folder):
-            os.makedirs(car_folder)
-            self.dialog.log_message(f"Pasta criada: {car_folder}")
+        if not vector_layers:
+            self.dialog.log_message("Nenhuma camada do CAR encontrada para exportar.")
+            return
         
+        if self.dialog.validate_check.isChecked():
+            self.start_validation(project, vector_layers)
+        else:
+            self.start_export(project, vector_layers)
+
+    def export_candidates(self, project):
+        from .car_core import register_existing_layers
+        from .car_session import scoped_car_layers, duplicate_layer_names
+        # Só as camadas registradas pelo plugin, e só as do imóvel ativo da sessão;
+        # camadas de apoio, de erro ou de outros imóveis ficam de fora
+        registered = register_existing_layers(project.layerTreeRoot())
+        if registered:
+            self.dialog.log_message(f"{registered} camada(s) existente(s) registrada(s) como camadas do CAR")
+        layers = scoped_car_layers(project)
+        duplicates = duplicate_layer_names(layers)
+        if duplicates:
+            # Dois arquivos com o mesmo nome no ZIP do SICAR: melhor não exportar
+            self.log_duplicate_layers(duplicates)
+            return None
+        return layers
+
+    def log_duplicate_layers(self, names):
+        self.dialog.log_message(f"Camadas do CAR repetidas no projeto: {', '.join(names)}. "
+                                "Organize os imóveis em uma sessão ou remova as camadas repetidas.")
+
+    def start_validation(self, project, vector_layers):
+        from .car_validation import CarValidationTask, VALIDATION_PROPERTY, collect_validation_sources
+        # Remove as camadas de erro de uma validação anterior
+        old_error_layers = [layer.id() for layer in project.mapLayers().values()
+                            if layer.customProperty(VALIDATION_PROPERTY)]
+        project.removeMapLayers(old_error_layers)
+        
+        self.dialog.log_message("Validando topologia das camadas...")
+        sources = collect_validation_sources(vector_layers, project)
+        self.validation_task = CarValidationTask(sources, project.transformContext())
+        self.validation_task.progressChanged.connect(self.dialog.set_progress)
+        self.validation_task.taskCompleted.connect(self.validation_finished)
+        self.validation_task.taskTerminated.connect(self.validation_terminated)
+        
+        self.dialog.set_export_running(True)
+        QgsApplication.taskManager().addTask(self.validation_task)
+
+    def validation_finished(self):
+        from .car_validation import build_error_layers, summarize_errors
+        task = self.validation_task
+        self.validation_task = None
+        self.dialog.set_export_running(False)
         project = QgsProject.instance()
-        layers = project.mapLayers().values()
         
-        # Filtrar apenas camadas vetoriais
-        vector_layers = [layer for layer in layers if isinstance(layer, QgsVectorLayer)]
+        if task.errors:
+            project.addMapLayers(build_error_layers(task.errors))
+            self.dialog.log_message(f"Validação encontrou {len(task.errors)} problema(s) de topologia:")
+            for line in summarize_errors(task.errors):
+                self.dialog.log_message(f"  {line}")
+            answer = QMessageBox.question(
+                self.dialog, "GeoCAR Poupa Tempo",
+                f"Foram encontrados {len(task.errors)} problema(s) de topologia "
+                "(veja as camadas \"Erros de topologia\").\n\nExportar mesmo assim?",
+                QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+            if answer != QMessageBox.Yes:
+                self.dialog.log_message("Exportação interrompida para correção da topologia.")
+                return
+        else:
+            self.dialog.log_message("Validação de topologia sem problemas.")
         
+        # As camadas podem ter mudado durante a validação (ex.: camada duplicada)
+        vector_layers = self.export_candidates(project)
+        if vector_layers is None:
+            return
         if not vector_layers:
-            self.dialog.log_message("Nenhuma camada vetorial encontrada para exportar.")
+            self.dialog.log_message("Nenhuma camada do CAR encontrada para exportar.")
             return
+        self.start_export(project, vector_layers)
+
+    def validation_terminated(self):
+        self.validation_task = None
+        self.dialog.set_export_running(False)
+        self.dialog.log_message("Validação cancelada.")
+
+    def start_export(self, project, vector_layers):
+        from .car_export import (CarExportTask, LayerExportJob, TransformCache, car_folder_path,
+                                 export_writer, remove_partial_files)
+        from .car_manifest import resume_manifest
+        # Obter nome do cliente e criar pasta no desktop
+        client_name = self.export_client_name()
+        car_folder = car_folder_path(client_name)
+        
+        if not os.path.exists(car_folder):
+            os.makedirs(car_folder)
+            self.dialog.log_message(f"Pasta criada: {car_folder}")
         
-        total_layers = len(vector_layers)
-        current_layer = 0
+        # A leitura das camadas acontece em segundo plano, a partir de um retrato
+        # tirado aqui na thread principal
+        reducer = self.export_reducer()
+        # Uma transformação por CRS de origem, compartilhada pelas camadas
+        transforms = TransformCache(project.transformContext())
+        jobs = [LayerExportJob(layer, project, reducer, transforms) for layer in vector_layers]
         
-        # CRS SIRGAS 2000 Geográficas
-        target_crs = QgsCoordinateReferenceSystem('EPSG:4674')
+        # O manifesto da última exportação permite pular camadas sem alterações; o
+        # diário de uma exportação interrompida entra nele, e os arquivos que ficaram
+        # pela metade são apagados
+        remove_partial_files(car_folder)
+        manifest, resumed = resume_manifest(car_folder)
+        if resumed:
+            self.dialog.log_message(f"Retomando exportação interrompida: {resumed} camada(s) já concluída(s)")
+        writer = export_writer(self.dialog.format_combo.currentData())
+        self.export_task = CarExportTask(jobs, car_folder, manifest, writer)
+        self.export_task.log_line.connect(self.dialog.log_message)
+        self.export_task.progressChanged.connect(self.dialog.set_progress)
+        self.export_task.taskCompleted.connect(self.export_finished)
+        self.export_task.taskTerminated.connect(self.export_terminated)
         
-        for layer in vector_layers:
-            try:
-                current_layer += 1
-                progress = int((current_layer / total_layers) * 100)
-                self.dialog.progress_bar.setValue(progress)
-                
-                layer_name = layer.name()
-                # Limpar nome do arquivo (remover caracteres especiais)
-                safe_name = "".join(c for c in layer_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
-                safe_name = safe_name.replace(' ', '_')
-                
-                self.dialog.log_message(f"Exportando camada: {layer_name}")
-                
-                # Criar pasta temporária para os arquivos shapefile
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    shapefile_path = os.path.join(temp_dir, f"{safe_name}.shp")
-                    
-                    # Configurar opções de exportação
-                    options = QgsVectorFileWriter.SaveVectorOptions()
-                    options.driverName = "ESRI Shapefile"
-                    options.fileEncoding = "UTF-8"
-                    
-                    # Transformar para SIRGAS 2000 se necessário
-                    if layer.crs() != target_crs:
-                        options.ct = QgsCoordinateTransform(layer.crs(), target_crs, project)
-                    
-                    # Exportar para shapefile
-                    error = QgsVectorFileWriter.writeAsVectorFormatV3(
-                        layer,
-                        shapefile_path,
-                        project.transformContext(),
-                        options
-                    )
-                    
-                    if error[0] == QgsVectorFileWriter.NoError:
-                        # Criar arquivo ZIP
-                        zip_path = os.path.join(car_folder, f"{safe_name}.zip")
-                        
-                        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                            # Adicionar todos os arquivos do shapefile ao ZIP
-                            for file in os.listdir(temp_dir):
-                                if file.startswith(safe_name):
-                                    file_path = os.path.join(temp_dir, file)
-                                    zipf.write(file_path, file)
-                        
-                        self.dialog.log_message(f"Camada exportada: {safe_name}.zip")
-                    else:
-                        self.dialog.log_message(f"Erro ao exportar {layer_name}: {error[1]}")
-                        
-            except Exception as e:
-                self.dialog.log_message(f"Erro ao processar camada {layer_name}: {str(e)}")
+        self.dialog.set_export_running(True)
+        self.export_started = time.perf_counter()
+        QgsApplication.taskManager().addTask(self.export_task)
+
+    def export_reducer(self):
+        from .car_simplify import GeometryReducer
+        if not self.dialog.reduce_check.isChecked():
+            return None
+        max_size = self.dialog.max_size_spin.value()
+        return GeometryReducer(self.dialog.decimals_spin.value(), self.dialog.tolerance_spin.value(),
+                               int(max_size * 1024 * 1024) if max_size else None)
+
+    def cancel_export(self):
+        if self.generation_task is not None:
+            self.generation_task.cancel()
+        if self.validation_task is not None:
+            self.validation_task.cancel()
+        if self.export_task is not None:
+            self.dialog.log_message("Cancelando exportação...")
+            self.export_task.cancel()
+
+    def export_finished(self):
+        from .car_export import format_size
+        from .car_areas import write_area_table
+        task = self.export_task
+        self.export_task = None
+        self.dialog.set_export_running(False)
         
-        self.dialog.progress_bar.setValue(100)
-        self.dialog.log_message(f"Exportação concluída! Arquivos salvos em: {car_folder}")
+        self.dialog.set_progress(100)
+        record_timing('exportacao', time.perf_counter() - self.export_started,
+                      camadas=len(task.layer_tasks), exportadas=len(task.exported),
+                      sem_alteracoes=len(task.skipped), com_erro=len(task.failed),
+                      formato=task.writer.key)
+        if task.skipped:
+            self.dialog.log_message(
+                f"{len(task.exported)} camada(s) exportada(s), {len(task.skipped)} sem alterações "
+                f"desde a última exportação")
+        if task.failed:
+            self.dialog.log_message(f"Camadas com erro: {', '.join(task.failed)}")
+        stats = [t.result.stats for t in task.layer_tasks if t.result.stats is not None]
+        if stats:
+            self.dialog.log_message(
+                f"Redução de vértices: {sum(s.vertices_before for s in stats):,} → "
+                f"{sum(s.vertices_after for s in stats):,}; ZIPs: "
+                f"{format_size(sum(s.zip_size_before for s in stats))} → "
+                f"{format_size(sum(s.zip_size for s in stats))}")
+        rows, reserva_percent = self.area_ledger.rows()
+        write_area_table(task.car_folder, rows, reserva_percent)
+        self.dialog.log_message(f"Exportação concluída! Arquivos salvos em: {task.car_folder}")
         
         # Abrir pasta no explorador de arquivos (funciona no Windows)
         try:
             if os.name == 'nt':  # Windows
-                os.startfile(car_folder)
+                os.startfile(task.car_folder)
             elif os.name == 'posix':  # Linux/Mac
-                os.system(f'xdg-open "{car_folder}"')
+                os.system(f'xdg-open "{task.car_folder}"')
         except:
             pass
 
-
-
+    def export_terminated(self):
+        self.export_task = None
+        self.dialog.set_export_running(False)
+        self.dialog.log_message("Exportação cancelada. Camadas já concluídas foram mantidas e a próxima exportação continua de onde parou.")
@@ -0,0 +1,220 @@
+import os
+import json
+from qgis.core import (QgsProject, QgsProcessingAlgorithm, QgsProcessingProvider,
+                       QgsProcessingException, QgsProcessingParameterEnum,
+                       QgsProcessingParameterString, QgsProcessingParameterFile,
+                       QgsProcessingParameterNumber, QgsProcessingParameterFileDestination,
+                       QgsProcessingOutputFolder, QgsProcessingOutputString,
+                       QgsProcessingOutputNumber)
+from PyQt5.QtGui import QIcon
+from .car_groups import CAR_GROUPS
+
+# O provedor é registrado na abertura do QGIS; os módulos que executam os
+# algoritmos só são importados em processAlgorithm
+
+GROUP_KEYS = list(CAR_GROUPS)
+GROUP_NAMES = [CAR_GROUPS[key][0] for key in GROUP_KEYS]
+
+
+class CarAlgorithm(QgsProcessingAlgorithm):
+    def group(self):
+        return 'GeoCAR Poupa Tempo'
+
+    def groupId(self):
+        return 'geocar'
+
+    def createInstance(self):
+        return type(self)()
+
+    def addGroupsParameter(self):
+        self.addParameter(QgsProcessingParameterEnum(
+            'GROUPS', 'Grupos do CAR', options=GROUP_NAMES, allowMultiple=True,
+            defaultValue=list(range(len(GROUP_KEYS)))))
+
+    def selectedGroups(self, parameters, context):
+        indexes = self.parameterAsEnums(parameters, 'GROUPS', context)
+        return [GROUP_KEYS[i] for i in indexes]
+
+
+class CreateCarStructureAlgorithm(CarAlgorithm):
+    def name(self):
+        return 'criarestrutura'
+
+    def displayName(self):
+        return 'Criar estrutura do CAR'
+
+    def shortHelpString(self):
+        return 'Cria no projeto atual os grupos e camadas do CAR selecionados.'
+
+    def flags(self):
+        # Mexe na árvore de camadas do projeto, então precisa rodar na thread principal
+        return super().flags() | QgsProcessingAlgorithm.FlagNoThreading
+
+    def initAlgorithm(self, config=None):
+        self.addGroupsParameter()
+        self.addOutput(QgsProcessingOutputNumber('LAYER_COUNT', 'Camadas criadas'))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        from .car_core import build_layer_structure
+        from .car_template import create_car_structure_from_template
+        project = context.project() or QgsProject.instance()
+        structure = build_layer_structure(self.selectedGroups(parameters, context))
+        layers = create_car_structure_from_template(project, project.layerTreeRoot(), structure,
+                                                    log=feedback.pushInfo,
+                                                    progress=feedback.setProgress)
+        return {'LAYER_COUNT': len(layers)}
+
+
+class ExportPropertyAlgorithm(CarAlgorithm):
+    def name(self):
+        return 'exportarimovel'
+
+    def displayName(self):
+        return 'Criar e exportar imóvel'
+
+    def shortHelpString(self):
+        return ('Cria a estrutura do CAR de um imóvel sem usar o projeto, carrega as camadas da '
+                'fonte (arquivo ou pasta, casadas pelo nome) e exporta os ZIPs para a pasta '
+                '"CAR FINALIZADO <cliente>" dentro da pasta de saída. GROUP_KEYS aceita '
+                f'{", ".join(GROUP_KEYS)} separados por vírgula; vazio cria todos os grupos. '
+                'FORMAT escolhe a saída: shp (ZIPs do SICAR, padrão), gpkg (GeoPackage único) '
+                'ou fgb (FlatGeobuf).')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterString('CLIENT_NAME', 'Nome do cliente'))
+        self.addParameter(QgsProcessingParameterFile(
+            'SOURCE', 'Fonte de dados do imóvel', optional=True))
+        self.addParameter(QgsProcessingParameterString(
+            'GROUP_KEYS', 'Grupos do CAR', defaultValue=','.join(GROUP_KEYS), optional=True))
+        self.addParameter(QgsProcessingParameterFile(
+            'OUTPUT_FOLDER', 'Pasta de saída', behavior=QgsProcessingParameterFile.Folder))
+        self.addParameter(QgsProcessingParameterString(
+            'FORMAT', 'Formato de saída', defaultValue='shp', optional=True))
+        self.addOutput(QgsProcessingOutputFolder('CAR_FOLDER', 'Pasta do CAR'))
+        self.addOutput(QgsProcessingOutputString('RESULT_JSON', 'Resultado (JSON)'))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        from .car_batch import process_property
+        item = {
+            'cliente': self.parameterAsString(parameters, 'CLIENT_NAME', context),
+            'fonte': self.parameterAsFile(parameters, 'SOURCE', context),
+            'grupos': self.parameterAsString(parameters, 'GROUP_KEYS', context),
+            'formato': self.parameterAsString(parameters, 'FORMAT', context),
+        }
+        output_folder = self.parameterAsFile(parameters, 'OUTPUT_FOLDER', context)
+        result = process_property(item, output_folder, log=feedback.pushInfo, feedback=feedback)
+        if result['status'] == 'erro':
+            raise QgsProcessingException(result['mensagem'])
+        return {'CAR_FOLDER': result['pasta'], 'RESULT_JSON': json.dumps(result, ensure_ascii=False)}
+
+
+class BatchExportAlgorithm(CarAlgorithm):
+    def name(self):
+        return 'lote'
+
+    def displayName(self):
+        return 'Criar e exportar imóveis em lote'
+
+    def shortHelpString(self):
+        return ('Processa vários imóveis sem interação. A entrada é um CSV com as colunas '
+                'cliente, fonte e grupos, ou uma pasta em que cada arquivo vetorial ou subpasta '
+                'é um imóvel. Com mais de um processo, cada imóvel roda num qgis_process '
+                'separado. O relatório traz o resultado e os tempos de cada imóvel.')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFile(
+            'INPUT_CSV', 'Lista de imóveis (CSV)', extension='csv', optional=True))
+        self.addParameter(QgsProcessingParameterFile(
+            'INPUT_FOLDER', 'Pasta de imóveis', behavior=QgsProcessingParameterFile.Folder,
+            optional=True))
+        self.addGroupsParameter()
+        self.addParameter(QgsProcessingParameterFile(
+            'OUTPUT_FOLDER', 'Pasta de saída', behavior=QgsProcessingParameterFile.Folder))
+        self.addParameter(QgsProcessingParameterNumber(
+            'WORKERS', 'Processos simultâneos', type=QgsProcessingParameterNumber.Integer,
+            minValue=1, defaultValue=1))
+        self.addParameter(QgsProcessingParameterFileDestination(
+            'REPORT', 'Relatório', fileFilter='CSV (*.csv)'))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        from .car_batch import read_batch_input, run_batch, write_report
+        input_path = (self.parameterAsFile(parameters, 'INPUT_CSV', context)
+                      or self.parameterAsFile(parameters, 'INPUT_FOLDER', context))
+        if not input_path:
+            raise QgsProcessingException('Informe um CSV ou uma pasta de imóveis')
+        output_folder = self.parameterAsFile(parameters, 'OUTPUT_FOLDER', context)
+        workers = self.parameterAsInt(parameters, 'WORKERS', context)
+        report_path = self.parameterAsFileOutput(parameters, 'REPORT', context)
+
+        items = read_batch_input(input_path)
+        feedback.pushInfo(f"{len(items)} imóvel(is) encontrados em {input_path}")
+        results = run_batch(items, output_folder, self.selectedGroups(parameters, context),
+                            workers, log=feedback.pushInfo, feedback=feedback)
+        write_report(report_path, results)
+
+        failures = [r['cliente'] for r in results if r['status'] == 'erro']
+        if failures:
+            feedback.reportError(f"Imóveis com erro: {', '.join(failures)}")
+        return {'REPORT': report_path}
+
+
+class DeliveryExportAlgorithm(CarAlgorithm):
+    def name(self):
+        return 'entrega'
+
+    def displayName(self):
+        return 'Exportar entrega de vários clientes'
+
+    def shortHelpString(self):
+        return ('Exporta de uma vez os clientes de uma pasta: projetos do QGIS (.qgs/.qgz) com '
+                'as camadas criadas pelo plugin gravadas em arquivo, ou GeoPackages do CAR '
+                '("CAR <cliente>.gpkg"). As camadas são gravadas e compactadas em paralelo, em '
+                'processos separados que usam só GDAL/OGR, nas pastas "CAR FINALIZADO <cliente>". '
+                'O relatório traz o resultado de cada cliente. Processos simultâneos 0 usa '
+                'todos os núcleos.')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterFile(
+            'INPUT_FOLDER', 'Pasta com projetos e GeoPackages dos clientes',
+            behavior=QgsProcessingParameterFile.Folder))
+        self.addParameter(QgsProcessingParameterFile(
+            'OUTPUT_FOLDER', 'Pasta de saída', behavior=QgsProcessingParameterFile.Folder))
+        self.addParameter(QgsProcessingParameterNumber(
+            'WORKERS', 'Processos simultâneos', type=QgsProcessingParameterNumber.Integer,
+            minValue=0, defaultValue=0))
+        self.addParameter(QgsProcessingParameterFileDestination(
+            'REPORT', 'Relatório', fileFilter='CSV (*.csv)'))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        from .car_delivery import delivery_sources, collect_delivery, run_delivery, write_delivery_report
+        input_folder = self.parameterAsFile(parameters, 'INPUT_FOLDER', context)
+        output_folder = self.parameterAsFile(parameters, 'OUTPUT_FOLDER', context)
+        workers = self.parameterAsInt(parameters, 'WORKERS', context)
+        report_path = self.parameterAsFileOutput(parameters, 'REPORT', context)
+
+        clients = collect_delivery(delivery_sources(input_folder), output_folder)
+        feedback.pushInfo(f"{len(clients)} cliente(s) encontrados em {input_folder}")
+        results = run_delivery(clients, workers, log=feedback.pushInfo, feedback=feedback)
+        write_delivery_report(report_path, results)
+
+        failures = [r['cliente'] for r in results if r['status'] != 'ok']
+        if failures:
+            feedback.reportError(f"Clientes com erro: {', '.join(failures)}")
+        return {'REPORT': report_path}
+
+
+class CarProcessingProvider(QgsProcessingProvider):
+    def id(self):
+        return 'geocar'
+
+    def name(self):
+        return 'GeoCAR Poupa Tempo'
+
+    def icon(self):
+        return QIcon(os.path.join(os.path.dirname(__file__), 'icon.png'))
+
+    def loadAlgorithms(self):
+        self.addAlgorithm(CreateCarStructureAlgorithm())
+        self.addAlgorithm(ExportPropertyAlgorithm())
+        self.addAlgorithm(BatchExportAlgorithm())
+        self.addAlgorithm(DeliveryExportAlgorithm())
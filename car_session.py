@@ -0,0 +1,137 @@
+import os
+import json
+import time
+from qgis.core import QgsLayerTree
+from .car_core import (CAR_GROUPS, build_layer_structure, reconcile_car_structure, car_layers,
+                       is_car_layer)
+from .car_storage import car_storage_path, create_car_geopackage, geopackage_layer_factory
+from .car_log import record_timing
+
+# Sessão com vários imóveis no mesmo projeto: cada imóvel é um grupo de primeiro
+# nível "CAR <cliente>" com seu próprio GeoPackage. Só o imóvel ativo tem camadas
+# carregadas; os demais ficam como grupos vazios que guardam, nas propriedades,
+# o que é preciso para carregá-los de novo.
+SESSION_CLIENT_PROPERTY = 'geocar/cliente'
+SESSION_STORAGE_PROPERTY = 'geocar/gpkg'
+SESSION_GROUPS_PROPERTY = 'geocar/grupos_sessao'
+
+
+def session_group_name(client_name):
+    # Mesmo nome do GeoPackage do cliente (car_storage_path)
+    return f"CAR {client_name}"
+
+
+def session_groups(root):
+    return [child for child in root.children()
+            if QgsLayerTree.isGroup(child) and child.customProperty(SESSION_CLIENT_PROPERTY)]
+
+
+def find_session(root, client_name):
+    for group in session_groups(root):
+        if group.customProperty(SESSION_CLIENT_PROPERTY) == client_name:
+            return group
+    return None
+
+
+def session_client(group):
+    return group.customProperty(SESSION_CLIENT_PROPERTY)
+
+
+def is_loaded(group):
+    return bool(group.children())
+
+
+def active_session(root):
+    for group in session_groups(root):
+        if is_loaded(group):
+            return group
+    return None
+
+
+def scoped_car_layers(project):
+    # Camadas do CAR em que o plugin trabalha: com imóveis na sessão, só as do imóvel
+    # ativo, para nunca misturar camadas de mesmo nome de outro imóvel ou de uma
+    # estrutura fora da sessão
+    group = active_session(project.layerTreeRoot())
+    if group is None:
+        return car_layers(project)
+    return [node.layer() for node in group.findLayers() if is_car_layer(node.layer())]
+
+
+def duplicate_layer_names(layers):
+    seen, duplicates = set(), set()
+    for layer in layers:
+        (duplicates if layer.name() in seen else seen).add(layer.name())
+    return sorted(duplicates)
+
+
+def session_group_keys(group):
+    try:
+        return json.loads(group.customProperty(SESSION_GROUPS_PROPERTY) or '[]')
+    except ValueError:
+        return []
+
+
+def add_session(project, client_name, groups, log=None, progress=None):
+    # Cria (ou completa) o imóvel na sessão e o torna ativo
+    root = project.layerTreeRoot()
+    group = find_session(root, client_name)
+    gpkg_path = car_storage_path(client_name)
+    if group is None:
+        group = root.addGroup(session_group_name(client_name))
+        group.setCustomProperty(SESSION_CLIENT_PROPERTY, client_name)
+        group.setCustomProperty(SESSION_STORAGE_PROPERTY, gpkg_path)
+    keys = set(session_group_keys(group)) | set(groups)
+    keys = [key for key in CAR_GROUPS if key in keys]
+    group.setCustomProperty(SESSION_GROUPS_PROPERTY, json.dumps(keys))
+
+    created = create_car_geopackage(group.customProperty(SESSION_STORAGE_PROPERTY),
+                                    build_layer_structure(keys))
+    if log:
+        log(f"GeoPackage: {group.customProperty(SESSION_STORAGE_PROPERTY)} ({created} tabela(s) nova(s))")
+    return activate_session(project, group, log, progress)
+
+
+def check_unload(group):
+    # Camadas em edição não podem ser descarregadas sem perder as alterações
+    editing = [node.layer().name() for node in group.findLayers()
+               if node.layer() is not None and node.layer().isEditable()]
+    if editing:
+        raise RuntimeError(f"Salve ou descarte a edição antes de trocar de imóvel: {', '.join(editing)}")
+
+
+def unload_session(project, group):
+    # Os dados ficam no GeoPackage; no projeto sobra só o grupo com as propriedades
+    layer_ids = [node.layerId() for node in group.findLayers()]
+    project.removeMapLayers(layer_ids)
+    group.removeAllChildren()
+    group.setExpanded(False)
+
+
+def load_session(project, group, log=None, progress=None):
+    gpkg_path = group.customProperty(SESSION_STORAGE_PROPERTY)
+    if not gpkg_path or not os.path.exists(gpkg_path):
+        raise RuntimeError(f"GeoPackage do imóvel não encontrado: {gpkg_path}")
+    structure = build_layer_structure(session_group_keys(group))
+    layers = reconcile_car_structure(project, group, structure, log, progress,
+                                     layer_factory=geopackage_layer_factory(gpkg_path))
+    group.setExpanded(True)
+    return layers
+
+
+def activate_session(project, group, log=None, progress=None):
+    # Descarrega o imóvel ativo e carrega o escolhido: a memória usada acompanha só
+    # o imóvel ativo, não todos os da sessão
+    started = time.perf_counter()
+    others = [other for other in session_groups(project.layerTreeRoot())
+              if other is not group and is_loaded(other)]
+    for other in others:
+        check_unload(other)
+    for other in others:
+        unload_session(project, other)
+    layers = load_session(project, group, log, progress)
+    record_timing('troca_imovel', time.perf_counter() - started, cliente=session_client(group),
+                  camadas=len(layers), descarregados=len(others))
+    if log:
+        log(f"Imóvel ativo: {session_client(group)} ({time.perf_counter() - started:.2f} s)")
+    return layers
@@ -0,0 +1,51 @@
+from qgis.core import QgsWkbTypes
+
+# Metros por grau (aproximação usada para converter tolerâncias em graus no EPSG:4674)
+METERS_PER_DEGREE = 111320.0
+
+# Casas decimais padrão das coordenadas: 1e-7 grau, cerca de 1 cm
+DEFAULT_DECIMALS = 7
+
+# Tolerâncias (m) testadas quando há tamanho máximo do ZIP, da menor para a maior
+SEARCH_TOLERANCES = [0.0, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0]
+
+
+def vertex_count(geometry):
+    if geometry is None or geometry.isNull():
+        return 0
+    return geometry.constGet().nCoordinates()
+
+
+class GeometryReducer:
+    # Redução de vértices aplicada feição a feição na exportação (já em EPSG:4674):
+    # arredonda as coordenadas à grade da precisão, remove vértices repetidos e
+    # simplifica com a tolerância. A simplificação do GEOS usada por
+    # QgsGeometry.simplify preserva a topologia de cada geometria.
+    def __init__(self, decimals=DEFAULT_DECIMALS, tolerance=0.0, max_zip_size=None):
+        self.decimals = decimals
+        self.tolerance = tolerance
+        self.max_zip_size = max_zip_size
+        self.precision = 10.0 ** -decimals
+
+    def key(self):
+        # Entra no manifesto: mudar a redução força a nova exportação da camada
+        return [self.decimals, self.tolerance, self.max_zip_size]
+
+    def with_tolerance(self, tolerance):
+        return GeometryReducer(self.decimals, tolerance)
+
+    def reduce(self, geometry):
+        if geometry is None or geometry.isNull():
+            return geometry
+        reduced = geometry.snappedToGrid(self.precision, self.precision)
+        if reduced.isNull() or reduced.isEmpty():
+            # Geometria menor que a grade: mantém a original
+            return geometry
+        reduced.removeDuplicateNodes(self.precision / 2)
+        # Tolerância zero ainda remove os vértices colineares
+        simplified = reduced.simplify(self.tolerance / METERS_PER_DEGREE)
+        if not simplified.isNull() and not simplified.isEmpty():
+            reduced = simplified
+        if QgsWkbTypes.isMultiType(geometry.wkbType()):
+            reduced.convertToMultiType()
+        return reduced
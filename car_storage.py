@@ -0,0 +1,84 @@
+import os
+from osgeo import ogr, osr
+from qgis.core import QgsVectorLayer
+from .car_core import iter_structure_layers
+from .car_export import safe_file_name, safe_client_name
+
+# Tipos de geometria usados na estrutura do CAR
+OGR_GEOMETRY_TYPES = {
+    'MultiPolygon': ogr.wkbMultiPolygon,
+    'LineString': ogr.wkbLineString,
+    'Point': ogr.wkbPoint,
+}
+
+
+def car_storage_path(client_name, base_folder=None):
+    # GeoPackage de trabalho do cliente, ao lado da pasta "CAR FINALIZADO"
+    file_name = "CAR.gpkg"
+    if client_name:
+        file_name = f"CAR {safe_client_name(client_name)}.gpkg"
+    if base_folder is None:
+        base_folder = os.path.join(os.path.expanduser("~"), "Desktop")
+    return os.path.join(base_folder, file_name)
+
+
+def table_name(layer_name):
+    return safe_file_name(layer_name)
+
+
+def car_field_definitions():
+    # Campos básicos das camadas do CAR (os mesmos de car_fields)
+    nome = ogr.FieldDefn('nome', ogr.OFTString)
+    nome.SetWidth(255)
+    descricao = ogr.FieldDefn('descricao', ogr.OFTString)
+    descricao.SetWidth(500)
+    return [ogr.FieldDefn('id', ogr.OFTInteger), nome, descricao,
+            ogr.FieldDefn('data_criacao', ogr.OFTDate)]
+
+
+def create_car_geopackage(gpkg_path, structure):
+    # Cria numa única transação as tabelas que ainda não existem no GeoPackage,
+    # todas com índice espacial R-tree. Tabelas existentes (e seus dados) são mantidas.
+    driver = ogr.GetDriverByName('GPKG')
+    if os.path.exists(gpkg_path):
+        dataset = driver.Open(gpkg_path, 1)
+    else:
+        dataset = driver.CreateDataSource(gpkg_path)
+    if dataset is None:
+        raise RuntimeError(f"Não foi possível abrir o GeoPackage {gpkg_path}")
+
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4674)
+    srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+    created = 0
+    dataset.StartTransaction()
+    try:
+        for path, layer_name, geom_type in iter_structure_layers(structure):
+            name = table_name(layer_name)
+            if dataset.GetLayerByName(name) is not None:
+                continue
+            table = dataset.CreateLayer(name, srs, OGR_GEOMETRY_TYPES[geom_type],
+                                        options=['SPATIAL_INDEX=YES', f'IDENTIFIER={layer_name}'])
+            if table is None:
+                raise RuntimeError(f"Não foi possível criar a tabela {name}")
+            for field in car_field_definitions():
+                table.CreateField(field)
+            created += 1
+        dataset.CommitTransaction()
+    except Exception:
+        dataset.RollbackTransaction()
+        raise
+    finally:
+        dataset = None
+    return created
+
+
+def geopackage_layer_factory(gpkg_path):
+    # layer_factory para create_car_structure: camadas OGR apontando para as tabelas do GeoPackage
+    def create_layer(layer_name, geom_type):
+        layer = QgsVectorLayer(f"{gpkg_path}|layername={table_name(layer_name)}", layer_name, 'ogr')
+        if not layer.isValid():
+            return None
+        return layer
+    return create_layer
@@ -0,0 +1,82 @@
+import os
+import json
+import time
+import hashlib
+from qgis.core import QgsApplication, QgsLayerDefinition
+from .car_core import (schema_id, build_layer_tree, create_car_structure, index_layer_tree,
+                       reconcile_car_structure)
+from .car_log import record_timing
+
+# Modelos de estrutura (.qlr) ficam na pasta de configurações do perfil do QGIS
+TEMPLATE_FOLDER = 'geocar_templates'
+
+
+def template_folder():
+    return os.path.join(QgsApplication.qgisSettingsDirPath(), TEMPLATE_FOLDER)
+
+
+def template_path(structure):
+    # Um modelo por combinação de grupos selecionados
+    groups_key = hashlib.sha1(json.dumps(list(structure), ensure_ascii=False).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(template_folder(), f"car_{schema_id()}_{groups_key}.qlr")
+
+
+def remove_stale_templates():
+    prefix = f"car_{schema_id()}_"
+    folder = template_folder()
+    for file in os.listdir(folder):
+        if file.startswith('car_') and not file.startswith(prefix):
+            try:
+                os.remove(os.path.join(folder, file))
+            except OSError:
+                pass
+
+
+def build_template(structure, path):
+    # Gera a estrutura uma vez e grava como definição de camadas (.qlr)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    top_groups, layers = build_layer_tree(structure)
+    temp_path = path + '.tmp.qlr'
+    ok, error = QgsLayerDefinition.exportLayerDefinition(temp_path, top_groups)
+    if not ok:
+        raise RuntimeError(error)
+    os.replace(temp_path, path)
+    remove_stale_templates()
+
+
+def create_car_structure_from_template(project, root, structure, log=None, progress=None,
+                                       repair_fields=False):
+    # Instancia a estrutura a partir do modelo em cache com uma única carga do .qlr;
+    # o modelo é gerado na primeira vez. Em caso de falha, cria as camadas do zero.
+    # Se algum grupo da estrutura já está no projeto, completa a árvore existente
+    # em vez de carregar o modelo por cima (o que duplicaria grupos e camadas).
+    groups, layers, duplicates = index_layer_tree(root)
+    if any((name,) in groups for name in structure):
+        return reconcile_car_structure(project, root, structure, log, progress,
+                                       repair_fields=repair_fields)
+    started = time.perf_counter()
+    path = template_path(structure)
+    try:
+        if not os.path.exists(path):
+            if log:
+                log("Gerando modelo da estrutura do CAR...")
+            build_template(structure, path)
+
+        before = set(project.mapLayers())
+        ok, error = QgsLayerDefinition.loadLayerDefinition(path, project, root)
+        if not ok:
+            raise RuntimeError(error)
+    except Exception as e:
+        if log:
+            log(f"Modelo indisponível ({e}), criando camadas do zero")
+        return create_car_structure(project, root, structure, log, progress)
+
+    layers = [layer for layer_id, layer in project.mapLayers().items() if layer_id not in before]
+    record_timing('criacao', time.perf_counter() - started, camadas=len(layers), origem='modelo')
+    if log:
+        for name in structure:
+            log(f"Criando grupo: {name}")
+        log(f"{len(layers)} camadas criadas a partir do modelo em {time.perf_counter() - started:.2f} s")
+    if progress:
+        progress(100)
+    return layers
@@ -0,0 +1,279 @@
+from qgis.core import (QgsTask, QgsGeometry, QgsFeature, QgsFeatureRequest, QgsField,
+                       QgsSpatialIndex, QgsVectorLayer, QgsVectorLayerFeatureSource,
+                       QgsCoordinateReferenceSystem, QgsDistanceArea,
+                       QgsWkbTypes)
+from PyQt5.QtCore import QVariant
+from .car_export import TARGET_CRS
+
+IMOVEL_LAYER = 'Imóvel'
+
+# Camadas que podem ficar fora do Imóvel
+OUTSIDE_ALLOWED = {
+    'Reserva legal vinculada à compensação de outro imóvel',
+}
+
+# Pares de classes de cobertura do solo que não podem se sobrepor
+OVERLAP_RULES = [
+    ('Área Consolidada', 'Remanescente de Vegetação Nativa'),
+    ('Área Consolidada', 'Área de Regeneração'),
+    ('Remanescente de Vegetação Nativa', 'Área de Pousio'),
+    ('Remanescente de Vegetação Nativa', 'Área de Regeneração'),
+    ('Área de Pousio', 'Área de Regeneração'),
+]
+
+# Sobreposições e sobras menores que isso (m²) são ignoradas
+MIN_ERROR_AREA = 1.0
+
+# Propriedade que marca as camadas de erro (não são exportadas)
+VALIDATION_PROPERTY = 'geocar/validacao'
+
+RULE_INVALID = 'Geometria inválida'
+RULE_OUTSIDE = 'Fora do imóvel'
+RULE_OVERLAP = 'Sobreposição'
+RULE_NO_IMOVEL = 'Imóvel ausente'
+
+
+class TopologyError:
+    def __init__(self, rule, layer_name, fid, geometry, other_layer='', other_fid=None,
+                 area=0.0, description=''):
+        self.rule = rule
+        self.layer_name = layer_name
+        self.fid = fid
+        self.geometry = geometry
+        self.other_layer = other_layer
+        self.other_fid = other_fid
+        self.area = area
+        self.description = description
+
+
+class ValidationSource:
+    # Retrato da camada tirado na thread principal, como em LayerExportJob
+    def __init__(self, layer, project):
+        self.layer_name = layer.name()
+        self.source = QgsVectorLayerFeatureSource(layer)
+        self.crs = layer.crs()
+        self.geometry_type = QgsWkbTypes.geometryType(layer.wkbType())
+        self.transform_context = project.transformContext()
+
+
+def collect_validation_sources(layers, project):
+    sources = {}
+    for layer in layers:
+        if not isinstance(layer, QgsVectorLayer) or layer.customProperty(VALIDATION_PROPERTY):
+            continue
+        sources.setdefault(layer.name(), []).append(ValidationSource(layer, project))
+    return sources
+
+
+class TopologyValidator:
+    def __init__(self, sources, transform_context, feedback=None):
+        self.sources = sources
+        self.feedback = feedback
+        self.target_crs = QgsCoordinateReferenceSystem(TARGET_CRS)
+        # Áreas elipsoidais no GRS80 (elipsoide do SIRGAS 2000)
+        self.distance_area = QgsDistanceArea()
+        self.distance_area.setSourceCrs(self.target_crs, transform_context)
+        self.distance_area.setEllipsoid('GRS80')
+        self.errors = []
+        # Geometrias e índices são montados uma vez por camada e reaproveitados entre regras
+        self._geometries = {}
+        self._indexes = {}
+
+    def canceled(self):
+        return self.feedback is not None and self.feedback.isCanceled()
+
+    def geometries(self, source):
+        key = id(source)
+        if key not in self._geometries:
+            request = QgsFeatureRequest().setNoAttributes()
+            if source.crs != self.target_crs:
+                request.setDestinationCrs(self.target_crs, source.transform_context)
+            self._geometries[key] = {f.id(): f.geometry() for f in source.source.getFeatures(request)
+                                     if f.hasGeometry()}
+        return self._geometries[key]
+
+    def index(self, source):
+        key = id(source)
+        if key not in self._indexes:
+            index = QgsSpatialIndex()
+            for fid, geometry in self.geometries(source).items():
+                index.addFeature(fid, geometry.boundingBox())
+            self._indexes[key] = index
+        return self._indexes[key]
+
+    def area(self, geometry):
+        return self.distance_area.measureArea(geometry)
+
+    def run(self):
+        all_sources = [s for sources in self.sources.values() for s in sources]
+        steps = len(all_sources) * 2 + len(OVERLAP_RULES)
+        done = 0
+        for source in all_sources:
+            if self.canceled():
+                return self.errors
+            self.check_validity(source)
+            done += 1
+            self.set_progress(done, steps)
+        self.check_inside_imovel(all_sources)
+        done += len(all_sources)
+        self.set_progress(done, steps)
+        for layer_a, layer_b in OVERLAP_RULES:
+            if self.canceled():
+                return self.errors
+            for source_a in self.sources.get(layer_a, []):
+                for source_b in self.sources.get(layer_b, []):
+                    self.check_overlap(source_a, source_b)
+            done += 1
+            self.set_progress(done, steps)
+        return self.errors
+
+    def set_progress(self, done, steps):
+        if self.feedback is not None and steps:
+            self.feedback.setProgress(done * 100 / steps)
+
+    def check_validity(self, source):
+        for fid, geometry in self.geometries(source).items():
+            if geometry.isGeosValid():
+                continue
+            problems = geometry.validateGeometry(QgsGeometry.ValidatorGeos)
+            where = problems[0].where() if problems and problems[0].hasWhere() else None
+            location = QgsGeometry.fromPointXY(where) if where is not None else geometry.pointOnSurface()
+            message = problems[0].what() if problems else ''
+            self.errors.append(TopologyError(RULE_INVALID, source.layer_name, fid, location,
+                                             description=message))
+
+    def check_inside_imovel(self, all_sources):
+        imovel_sources = self.sources.get(IMOVEL_LAYER, [])
+        parts = [g for s in imovel_sources for g in self.geometries(s).values()]
+        if not parts:
+            if any(self.geometries(s) for s in all_sources if s.layer_name not in OUTSIDE_ALLOWED):
+                self.errors.append(TopologyError(RULE_NO_IMOVEL, IMOVEL_LAYER, None, None,
+                                                 description='Camada Imóvel vazia ou ausente'))
+            return
+
+        imovel = QgsGeometry.unaryUnion(parts)
+        imovel_box = imovel.boundingBox()
+        # Geometria preparada: contains/intersects repetidos ficam muito mais rápidos
+        engine = QgsGeometry.createGeometryEngine(imovel.constGet())
+        engine.prepareGeometry()
+
+        for source in all_sources:
+            if self.canceled():
+                return
+            if source.layer_name == IMOVEL_LAYER or source.layer_name in OUTSIDE_ALLOWED:
+                continue
+            for fid, geometry in self.geometries(source).items():
+                box = geometry.boundingBox()
+                if imovel_box.contains(box) and engine.contains(geometry.constGet()):
+                    continue
+                if box.intersects(imovel_box) and engine.intersects(geometry.constGet()):
+                    outside = geometry.difference(imovel)
+                else:
+                    outside = geometry
+                self.add_outside_error(source, fid, outside)
+
+    def add_outside_error(self, source, fid, outside):
+        if outside.isEmpty():
+            return
+        if source.geometry_type == QgsWkbTypes.PolygonGeometry:
+            area = self.area(outside)
+            if area < MIN_ERROR_AREA:
+                return
+            self.errors.append(TopologyError(RULE_OUTSIDE, source.layer_name, fid, outside, area=area))
+        else:
+            self.errors.append(TopologyError(RULE_OUTSIDE, source.layer_name, fid,
+                                             outside.pointOnSurface()))
+
+    def check_overlap(self, source_a, source_b):
+        # Só os pares cujos retângulos envolventes se cruzam são testados
+        geometries_b = self.geometries(source_b)
+        if not geometries_b:
+            return
+        index_b = self.index(source_b)
+        for fid_a, geometry_a in self.geometries(source_a).items():
+            if self.canceled():
+                return
+            candidates = index_b.intersects(geometry_a.boundingBox())
+            if not candidates:
+                continue
+            engine = QgsGeometry.createGeometryEngine(geometry_a.constGet())
+            engine.prepareGeometry()
+            for fid_b in candidates:
+                geometry_b = geometries_b[fid_b]
+                if not engine.intersects(geometry_b.constGet()):
+                    continue
+                overlap = geometry_a.intersection(geometry_b)
+                # Sobreposição com toque em linha ou ponto vem como GeometryCollection:
+                # fica só a parte de área
+                overlap.convertGeometryCollectionToSubclass(QgsWkbTypes.PolygonGeometry)
+                if overlap.isEmpty() or QgsWkbTypes.geometryType(overlap.wkbType()) != QgsWkbTypes.PolygonGeometry:
+                    continue
+                area = self.area(overlap)
+                if area < MIN_ERROR_AREA:
+                    continue
+                self.errors.append(TopologyError(RULE_OVERLAP, source_a.layer_name, fid_a, overlap,
+                                                 source_b.layer_name, fid_b, area))
+
+
+def error_fields():
+    return [
+        QgsField('regra', QVariant.String, len=50),
+        QgsField('camada', QVariant.String, len=255),
+        QgsField('feicao', QVariant.LongLong),
+        QgsField('camada_2', QVariant.String, len=255),
+        QgsField('feicao_2', QVariant.LongLong),
+        QgsField('area_m2', QVariant.Double),
+        QgsField('descricao', QVariant.String, len=255),
+    ]
+
+
+def build_error_layers(errors):
+    # Erros de área (sobreposições e sobras fora do imóvel) e erros pontuais
+    # ficam em camadas separadas
+    polygons = QgsVectorLayer(f'MultiPolygon?crs={TARGET_CRS.lower()}', 'Erros de topologia (áreas)', 'memory')
+    points = QgsVectorLayer(f'Point?crs={TARGET_CRS.lower()}', 'Erros de topologia (pontos)', 'memory')
+    for layer in (polygons, points):
+        layer.dataProvider().addAttributes(error_fields())
+        layer.updateFields()
+        layer.setCustomProperty(VALIDATION_PROPERTY, True)
+
+    polygon_features, point_features = [], []
+    for error in errors:
+        if error.geometry is None:
+            continue
+        is_polygon = QgsWkbTypes.geometryType(error.geometry.wkbType()) == QgsWkbTypes.PolygonGeometry
+        target = polygons if is_polygon else points
+        feature = QgsFeature(target.fields())
+        geometry = QgsGeometry(error.geometry)
+        if is_polygon:
+            geometry.convertToMultiType()
+        feature.setGeometry(geometry)
+        feature.setAttributes([error.rule, error.layer_name, error.fid, error.other_layer,
+                               error.other_fid, round(error.area, 2), error.description])
+        (polygon_features if is_polygon else point_features).append(feature)
+
+    polygons.dataProvider().addFeatures(polygon_features)
+    points.dataProvider().addFeatures(point_features)
+    return [layer for layer in (polygons, points) if layer.featureCount()]
+
+
+def summarize_errors(errors):
+    summary = {}
+    for error in errors:
+        key = f"{error.rule}: {error.layer_name}"
+        if error.other_layer:
+            key += f" x {error.other_layer}"
+        summary[key] = summary.get(key, 0) + 1
+    return [f"{key} ({count})" for key, count in sorted(summary.items())]
+
+
+class CarValidationTask(QgsTask):
+    def __init__(self, sources, transform_context):
+        super().__init__("GeoCAR Poupa Tempo: validação de topologia", QgsTask.CanCancel)
+        self.sources = sources
+        self.transform_context = transform_context
+        self.errors = []
+
+    def run(self):
+        self.errors = TopologyValidator(self.sources, self.transform_context, self).run()
+        return not self.isCanceled()